@@ -0,0 +1,88 @@
+from contextlib import AsyncExitStack, asynccontextmanager
+
+from anyio import to_thread
+from fastapi import FastAPI, Depends
+from fastapi.responses import ORJSONResponse
+
+from classes.logger import Logger
+from database.migrations import MigrationManager
+from database.task_cleanup import TaskCleanup
+from middleware.ip_whitelist import IPWhitelistMiddleware
+from routes.conversation import conversations
+from routes.dictionaries import dictionaries
+from routes.recordings import recordings
+from routes.tags import tags
+
+from database.database import db_manager
+from classes.settings import settings
+from threads.analyze_text_thread import TaskProcessor
+from threads.executor import app_executor
+from threads.recognize_record_thread import recognize_thread
+
+
+@asynccontextmanager
+async def scheduler_lifespan():
+    """Фоновые задачи распознавания и анализа; запускаются только в процессе-планировщике"""
+    # Сбрасываем зависшие задачи
+    TaskCleanup.reset_stuck_tasks()
+    # Только если используем Nuitka (проверка скомпилированного режима)
+    MigrationManager.run_migrations()
+    recognize_thread.start()
+
+    # Инициализация обработчика задач
+    analyze_text_processor = TaskProcessor(max_workers=4)
+    analyze_text_processor.start_fetcher(interval=30)
+
+    try:
+        yield
+    finally:
+        # Останавливаем потоки при завершении
+        recognize_thread.stop()
+        analyze_text_processor.shutdown()
+        # Общий пул останавливается последним: текущее распознавание, как и раньше, не дожидаемся
+        app_executor.shutdown(wait=False, cancel_futures=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    Logger.info('Generator lifespan at start of app')
+    # Синхронные обработчики маршрутов выполняются в пуле потоков anyio (по умолчанию 40 потоков)
+    # и держат поток на все время запроса к БД
+    to_thread.current_default_thread_limiter().total_tokens = settings.API_THREADS
+    async with AsyncExitStack() as stack:
+        if settings.scheduler_role:
+            await stack.enter_async_context(scheduler_lifespan())
+        else:
+            Logger.info('Scheduler role is disabled, background tasks are not started')
+        yield
+    # Clean up the ML entities and release the resources
+    Logger.info('Finish lifespan at end of app')
+
+
+app = FastAPI(
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+    root_path=settings.API_ROOT,
+    docs_url="/docs" if settings.APP_MODE != "production" else None,
+    redoc_url="/redoc" if settings.APP_MODE != "production" else None,
+    openapi_url="/openapi.json" if settings.APP_MODE != "production" else None
+)
+
+# Добавляем middleware если включена IP-фильтрация
+if settings.ENABLE_IP_WHITELIST:
+    app.add_middleware(IPWhitelistMiddleware)
+    Logger.info(f"IP whitelist enabled. Allowed IPs: {settings.ALLOWED_IPS}")
+else:
+    Logger.info("IP whitelist is disabled")
+
+
+@app.get("/health")
+async def health_check():
+    return {"status": "healthy", "service": "whisper-api"}
+
+
+app.include_router(recordings)
+app.include_router(dictionaries)
+
+app.include_router(conversations)
+app.include_router(tags)
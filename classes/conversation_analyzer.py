@@ -1,184 +1,345 @@
 import os
-import time
-import tempfile
+import subprocess
 import requests
+import ctranslate2
+import numpy as np
+import soundfile as sf
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
-from typing import List, Union
-import whisper
-from pydub import AudioSegment
-from urllib.parse import urlparse
+from threading import Lock, Thread
+from typing import IO, Iterable, List, Tuple, Union
+from faster_whisper import WhisperModel, BatchedInferencePipeline
+from faster_whisper.vad import VadOptions, get_speech_timestamps, merge_segments
 
+from classes.logger import Logger
 from models.recognizer_models import Utterance, ConversationAnalysis
 
+SAMPLING_RATE = 16000
+CHUNK_LENGTH = 30  # Максимальная длина фрагмента, который Whisper декодирует за раз (сек)
+DOWNLOAD_CHUNK_SIZE = 65536
+MODEL_WORKERS = 2  # Параллельные запросы к модели: по одному на канал стерео
+
+# Загруженные модели общие для всех экземпляров: {(model_name, device, compute_type): pipeline}
+_MODEL_CACHE: dict[tuple[str, str, str], BatchedInferencePipeline] = {}
+_MODEL_CACHE_LOCK = Lock()
+
+
+def _default_device() -> str:
+    """Возвращает "cuda", если CTranslate2 видит GPU, иначе "cpu"."""
+    return "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+
+
+def _default_compute_type(device: str) -> str:
+    """float16 на GPU, int8 на CPU — быстрые ядра CTranslate2 при сопоставимом WER."""
+    return "float16" if device == "cuda" else "int8"
+
+
+def _get_model(model_name: str, device: str, compute_type: str) -> BatchedInferencePipeline:
+    """Возвращает пайплайн Whisper, загружая модель только при первом обращении."""
+    key = (model_name, device, compute_type)
+    with _MODEL_CACHE_LOCK:
+        if key not in _MODEL_CACHE:
+            _MODEL_CACHE[key] = BatchedInferencePipeline(
+                model=WhisperModel(
+                    model_name,
+                    device=device,
+                    compute_type=compute_type,
+                    num_workers=MODEL_WORKERS,
+                    download_root=os.environ.get("WHISPER_CACHE_DIR")
+                )
+            )
+        return _MODEL_CACHE[key]
+
 
 class ConversationAnalyzer:
-    def __init__(self, model_name: str = "large"):
-        if not os.path.exists('./tmp'):
-            os.makedirs('./tmp', mode=0o755, exist_ok=True)
+    def __init__(
+            self,
+            model_name: str = "large",
+            batch_size: int = 16,
+            device: str | None = None,
+            compute_type: str | None = None
+    ):
         """
         Инициализация анализатора разговоров.
 
         :param model_name: Название модели Whisper (по умолчанию "large")
+        :param batch_size: Количество 30-секундных фрагментов, декодируемых за один проход
+        :param device: Устройство CTranslate2 ("cuda", "cpu"), по умолчанию GPU при наличии
+        :param compute_type: Тип вычислений CTranslate2, по умолчанию float16 на GPU и int8 на CPU
         """
-        self.model = whisper.load_model(model_name)
-        self.temp_files = []  # Для хранения путей временных файлов
+        device = device or _default_device()
+        compute_type = compute_type or _default_compute_type(device)
+        self.model = _get_model(model_name, device, compute_type)
+        self.batch_size = batch_size
 
-    def __del__(self):
-        """Удаление временных файлов при уничтожении объекта."""
-        self.cleanup_temp_files()
+    @staticmethod
+    def _open_url(url: str) -> Iterable[bytes]:
+        """Открывает потоковое скачивание файла по URL и возвращает итератор чанков."""
+        try:
+            response = requests.get(url, stream=True)
+            response.raise_for_status()
+            return response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+        except Exception as e:
+            raise RuntimeError(f"Ошибка загрузки файла по URL: {e}")
 
-    def cleanup_temp_files(self):
-        """Удаляет все временные файлы, созданные экземпляром класса."""
-        for file_path in self.temp_files:
+    @staticmethod
+    def _pump_to_stdin(chunks: Iterable[bytes], stdin: IO[bytes], errors: list[Exception]):
+        """Передает данные в stdin ffmpeg по мере поступления и закрывает его."""
+        try:
+            for chunk in chunks:
+                stdin.write(chunk)
+        except BrokenPipeError:
+            pass  # ffmpeg завершился раньше, причина будет в его stderr
+        except Exception as e:
+            errors.append(e)
+        finally:
             try:
-                os.remove(file_path)
-            except:
+                stdin.close()
+            except BrokenPipeError:
                 pass
-        self.temp_files = []
 
-    def _download_from_url(self, url: str) -> str:
-        """Скачивает файл по URL во временный файл и возвращает путь к нему."""
+    @staticmethod
+    def _read_wav(path: str) -> np.ndarray | None:
+        """
+        Читает WAV через libsndfile, если он уже в 16 кГц стерео: массив (N, 2) float32.
+        Для остальных WAV возвращает None — их нужно пересэмплировать через ffmpeg.
+        """
         try:
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
-
-            # Создаем временный файл с правильным расширением
-            parsed_url = urlparse(url)
-            ext = os.path.splitext(parsed_url.path)[1] or '.mp3'
-            temp_file = tempfile.NamedTemporaryFile(suffix=ext, delete=False)
-            temp_path = temp_file.name
+            info = sf.info(path)
+        except sf.LibsndfileError:
+            return None
+        if info.samplerate != SAMPLING_RATE or info.channels != 2:
+            return None
+        audio, _ = sf.read(path, dtype='float32', always_2d=True)
+        return audio
+
+    def _decode_with_ffmpeg(self, audio_source: str, chunks: Iterable[bytes] | None) -> np.ndarray:
+        """
+        Декодирует источник ffmpeg в 16 кГц float32 стерео: массив (N, 2).
 
-            for chunk in response.iter_content(chunk_size=8192):
-                temp_file.write(chunk)
-            temp_file.close()
+        :param audio_source: Путь к файлу или "pipe:0", если данные подаются через chunks
+        :param chunks: Данные для stdin ffmpeg (скачиваемый файл или байты) либо None для файла
+        """
+        process = subprocess.Popen(
+            [
+                "ffmpeg", "-v", "error",
+                "-i", audio_source,
+                "-ac", "2", "-ar", str(SAMPLING_RATE),
+                "-f", "f32le", "-"
+            ],
+            stdin=subprocess.DEVNULL if chunks is None else subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
 
-            self.temp_files.append(temp_path)
-            return temp_path
-        except Exception as e:
-            raise RuntimeError(f"Ошибка загрузки файла по URL: {e}")
+        download_errors: list[Exception] = []
+        pump = None
+        if chunks is not None:
+            pump = Thread(
+                target=self._pump_to_stdin,
+                args=(chunks, process.stdin, download_errors),
+                daemon=True
+            )
+            pump.start()
+
+        pcm = process.stdout.read()
+        stderr = process.stderr.read()
+        process.wait()
+        if pump:
+            pump.join()
+
+        if download_errors:
+            raise RuntimeError(f"Ошибка загрузки файла по URL: {download_errors[0]}")
+        if process.returncode != 0:
+            raise RuntimeError(f"Ошибка декодирования аудио: {stderr.decode(errors='ignore')}")
+
+        return np.frombuffer(pcm, dtype=np.float32).reshape(-1, 2)
+
+    def split_stereo_audio(self, audio_source: Union[str, bytes]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Разделяет стерео аудио на левый и правый каналы в памяти.
 
-    def _ensure_local_file(self, audio_source: Union[str, bytes]) -> str:
-        """Обеспечивает наличие локального файла, обрабатывая как пути, так и URL."""
+        ffmpeg один раз декодирует источник в 16 кГц float32 PCM, каналы
+        возвращаются как массивы numpy без промежуточных файлов на диске.
+        URL и бинарные данные подаются в stdin ffmpeg, поэтому декодирование
+        идет параллельно со скачиванием. Локальный WAV, уже записанный
+        в 16 кГц стерео, читается напрямую через soundfile без запуска ffmpeg.
+        """
+        audio = None
         if isinstance(audio_source, bytes):
-            # Если переданы байты, создаем временный файл
-            temp_file = tempfile.NamedTemporaryFile(suffix='.mp3', delete=False)
-            temp_path = temp_file.name
-            temp_file.write(audio_source)
-            temp_file.close()
-            self.temp_files.append(temp_path)
-            return temp_path
+            audio = self._decode_with_ffmpeg("pipe:0", [audio_source])
         elif audio_source.startswith(('http://', 'https://')):
-            # Если это URL, скачиваем файл
-            return self._download_from_url(audio_source)
-        else:
-            # Если это локальный путь, просто возвращаем его
-            return audio_source
-
-    def split_stereo_audio(self, audio_path: str) -> tuple[str, str]:
-        """Разделяет стерео аудиофайл на два монофайла (левый и правый каналы)."""
-        # Поддерживаемые форматы
-        if audio_path.lower().endswith('.mp3'):
-            audio = AudioSegment.from_mp3(audio_path)
-        elif audio_path.lower().endswith('.wav'):
-            audio = AudioSegment.from_wav(audio_path)
-        else:
+            audio = self._decode_with_ffmpeg("pipe:0", self._open_url(audio_source))
+        elif not audio_source.lower().endswith(('.mp3', '.wav')):
+            # Поддерживаемые форматы
             raise ValueError("Поддерживаются только MP3 и WAV файлы")
+        else:
+            if audio_source.lower().endswith('.wav'):
+                audio = self._read_wav(audio_source)
+            if audio is None:
+                audio = self._decode_with_ffmpeg(audio_source, None)
 
-        # Создаем уникальные имена файлов
-        timestamp = int(time.time() * 1000)
+        # Левый канал (клиент), правый канал (оператор)
+        left_channel = np.ascontiguousarray(audio[:, 0])
+        right_channel = np.ascontiguousarray(audio[:, 1])
 
-        # Левый канал (клиент)
-        left_channel = audio.split_to_mono()[0]
-        left_path = f"./tmp/temp_left_{timestamp}.wav"
-        left_channel.export(left_path, format="wav")
-        self.temp_files.append(left_path)
+        return left_channel, right_channel
 
-        # Правый канал (оператор)
-        right_channel = audio.split_to_mono()[1]
-        right_path = f"./tmp/temp_right_{timestamp}.wav"
-        right_channel.export(right_path, format="wav")
-        self.temp_files.append(right_path)
+    @staticmethod
+    def _vad_segment(audio: np.ndarray) -> list[dict]:
+        """
+        Находит участки речи в канале и упаковывает их в фрагменты до CHUNK_LENGTH секунд.
 
-        return left_path, right_path
+        В стерео каждый канал большую часть времени молчит (говорит собеседник),
+        поэтому Whisper получает только речь, а не весь файл окнами по 30 секунд.
+        Возвращает список {'start', 'end'} в сэмплах.
+        """
+        vad_options = VadOptions(
+            max_speech_duration_s=CHUNK_LENGTH,
+            min_silence_duration_ms=500,
+            speech_pad_ms=200
+        )
+        speech_regions = get_speech_timestamps(audio, vad_options, sampling_rate=SAMPLING_RATE)
+        return merge_segments(speech_regions, vad_options, sampling_rate=SAMPLING_RATE)
 
-    def transcribe_audio(self, audio_path: str) -> list[dict]:
-        """Транскрибирует аудиофайл с помощью Whisper и возвращает сегменты."""
-        result = self.model.transcribe(
-            audio_path,
-            verbose=True,
+    def transcribe_audio(self, audio: np.ndarray) -> list[dict]:
+        """
+        Транскрибирует моноканал (16 кГц float32) пакетным пайплайном faster-whisper.
+
+        Участки речи, найденные VAD, декодируются на GPU пачками по batch_size,
+        время сегментов пересчитывается пайплайном в абсолютное время файла.
+        """
+        clip_timestamps = self._vad_segment(audio)
+        if not clip_timestamps:
+            # В канале нет речи — декодировать нечего
+            return []
+
+        segments, _ = self.model.transcribe(
+            audio,
+            clip_timestamps=clip_timestamps,
+            batch_size=self.batch_size,
             temperature=0,
             language="ru",
-            condition_on_previous_text=False  # Критично важно!
+            condition_on_previous_text=False,  # Критично важно!
+            without_timestamps=False
         )
-        time.sleep(1)
-        return result["segments"]
+        # Генератор сегментов запускает декодирование — материализуем его
+        return [
+            {'start': seg.start, 'end': seg.end, 'text': seg.text}
+            for seg in segments
+        ]
+
+    def transcribe_batch(self, channels: list[np.ndarray]) -> list[list[dict]]:
+        """
+        Транскрибирует несколько каналов одновременно.
+
+        CTranslate2 освобождает GIL и обслуживает параллельные запросы
+        несколькими воркерами модели (MODEL_WORKERS), поэтому каналы
+        декодируются одновременно, а не друг за другом.
+        Возвращает список сегментов для каждого канала в порядке channels.
+        """
+        with ThreadPoolExecutor(max_workers=len(channels), thread_name_prefix="Transcribe") as executor:
+            return list(executor.map(self.transcribe_audio, channels))
 
     @staticmethod
     def format_time(seconds: float) -> str:
         """Форматирует время в читаемый формат (HH:MM:SS)."""
         return str(timedelta(seconds=round(seconds)))
 
+    @staticmethod
+    def _merge_sorted_dicts(
+            speakers: np.ndarray,
+            starts: np.ndarray,
+            ends: np.ndarray,
+            texts: List[str],
+            max_pause: float
+    ) -> List[dict]:
+        """
+        Объединяет отсортированные по началу реплики в группы за один векторный проход.
+
+        Новая группа начинается при смене говорящего или паузе больше max_pause;
+        словари с полями Utterance создаются только для итоговых групп.
+        """
+        if len(starts) == 0:
+            return []
+
+        boundaries = np.flatnonzero(np.r_[
+            True,
+            (speakers[1:] != speakers[:-1]) | (starts[1:] - ends[:-1] > max_pause)
+        ])
+        last_indexes = np.r_[boundaries[1:], len(starts)] - 1
+
+        return [
+            {
+                "speaker": str(speakers[first]),
+                "text": ' '.join(texts[first:last + 1]),
+                "start_time": float(starts[first]),
+                "end_time": float(ends[last]),
+            }
+            for first, last in zip(boundaries.tolist(), last_indexes.tolist())
+        ]
+
+    @staticmethod
+    def _merge_sorted(
+            speakers: np.ndarray,
+            starts: np.ndarray,
+            ends: np.ndarray,
+            texts: List[str],
+            max_pause: float
+    ) -> List[Utterance]:
+        """То же, что _merge_sorted_dicts, но объектами Utterance; типы полей уже приведены, валидация не нужна"""
+        return [
+            Utterance.model_construct(**utterance)
+            for utterance in ConversationAnalyzer._merge_sorted_dicts(speakers, starts, ends, texts, max_pause)
+        ]
+
     @staticmethod
     def merge_adjacent_utterances(utterances: List[Utterance], max_pause: float = 1.0) -> List[Utterance]:
         """
         Объединяет соседние реплики одного и того же говорящего,
         если пауза между ними меньше max_pause секунд.
         """
-        if not utterances:
-            return []
+        return ConversationAnalyzer._merge_sorted(
+            np.array([u.speaker for u in utterances]),
+            np.fromiter((u.start_time for u in utterances), dtype=np.float64, count=len(utterances)),
+            np.fromiter((u.end_time for u in utterances), dtype=np.float64, count=len(utterances)),
+            [u.text for u in utterances],
+            max_pause
+        )
 
-        merged = [utterances[0]]
+    @staticmethod
+    def _merge_segments(client_segments: list[dict], operator_segments: list[dict]) -> List[dict]:
+        """Сводит сегменты клиента и оператора в реплики по времени — словарями с полями Utterance"""
+        segments = client_segments + operator_segments
+        if not segments:
+            return []
 
-        for current in utterances[1:]:
-            last = merged[-1]
+        speakers = np.array(["client"] * len(client_segments) + ["operator"] * len(operator_segments))
+        starts = np.fromiter((seg['start'] for seg in segments), dtype=np.float64, count=len(segments))
+        ends = np.fromiter((seg['end'] for seg in segments), dtype=np.float64, count=len(segments))
 
-            # Если тот же говорящий и пауза небольшая - объединяем
-            if (current.speaker == last.speaker and
-                    current.start_time - last.end_time <= max_pause):
-                new_text = f"{last.text} {current.text}"
-                new_utterance = Utterance(
-                    speaker=last.speaker,
-                    text=new_text,
-                    start_time=last.start_time,
-                    end_time=current.end_time
-                )
-                merged[-1] = new_utterance
-            else:
-                merged.append(current)
+        # Сортируем все реплики по времени начала
+        order = np.argsort(starts, kind='stable')
 
-        return merged
+        # Объединяем соседние реплики одного говорящего
+        return ConversationAnalyzer._merge_sorted_dicts(
+            speakers[order],
+            starts[order],
+            ends[order],
+            [segments[i]['text'] for i in order.tolist()],
+            max_pause=1.0
+        )
 
     @staticmethod
     def analyze_conversation(client_segments: list[dict], operator_segments: list[dict]) -> ConversationAnalysis:
         """Анализирует сегменты клиента и оператора, возвращая структурированные данные."""
-        utterances: List[Utterance] = []
-
-        # Создаем объекты Utterance для клиента
-        for seg in client_segments:
-            utterances.append(Utterance(
-                speaker="client",
-                text=seg['text'],
-                start_time=seg['start'],
-                end_time=seg['end']
-            ))
-
-        # Создаем объекты Utterance для оператора
-        for seg in operator_segments:
-            utterances.append(Utterance(
-                speaker="operator",
-                text=seg['text'],
-                start_time=seg['start'],
-                end_time=seg['end']
-            ))
-
-        # Сортируем все реплики по времени начала
-        utterances.sort(key=lambda x: x.start_time)
-
-        # Объединяем соседние реплики одного говорящего
-        utterances = ConversationAnalyzer.merge_adjacent_utterances(utterances)
+        utterances = [
+            Utterance.model_construct(**utterance)
+            for utterance in ConversationAnalyzer._merge_segments(client_segments, operator_segments)
+        ]
 
         # Вычисляем общую продолжительность
-        duration = max(u.end_time for u in utterances) if utterances else 0
+        duration = max((u.end_time for u in utterances), default=0)
 
         return ConversationAnalysis(
             utterances=utterances,
@@ -202,19 +363,30 @@ class ConversationAnalyzer:
         :param audio_source: Путь к аудиофайлу, URL или бинарные данные аудио
         :return: Результаты анализа разговора
         """
-        # Получаем локальный путь к файлу (скачиваем если это URL)
-        local_path = self._ensure_local_file(audio_source)
+        client_segments, operator_segments = self._transcribe_source(audio_source)
 
-        # Разделяем стереофайл на два монофайла
-        left_path, right_path = self.split_stereo_audio(local_path)
+        # Анализируем разговор
+        analysis = self.analyze_conversation(client_segments, operator_segments)
 
-        print(audio_source)
+        return analysis
 
-        # Транскрибируем оба канала
-        client_segments = self.transcribe_audio(left_path)
-        operator_segments = self.transcribe_audio(right_path)
+    def analyze_as_dicts(self, audio_source: Union[str, bytes]) -> Tuple[float, List[dict]]:
+        """
+        То же, что analyze, но без моделей Utterance: реплики сразу в виде для записи в БД.
 
-        # Анализируем разговор
-        analysis = self.analyze_conversation(client_segments, operator_segments)
+        :param audio_source: Путь к аудиофайлу, URL или бинарные данные аудио
+        :return: Продолжительность разговора и реплики словарями с полями Utterance
+        """
+        utterances = self._merge_segments(*self._transcribe_source(audio_source))
+        return max((u["end_time"] for u in utterances), default=0), utterances
+
+    def _transcribe_source(self, audio_source: Union[str, bytes]) -> Tuple[list[dict], list[dict]]:
+        """Сегменты клиента (левый канал) и оператора (правый канал)"""
+        # Декодируем источник (путь, URL или байты) сразу в два канала
+        left_channel, right_channel = self.split_stereo_audio(audio_source)
+
+        if isinstance(audio_source, str):
+            Logger.debug(f"Analyzing audio source: {audio_source}")
 
-        return analysis
\ No newline at end of file
+        # Транскрибируем оба канала одним пакетным вызовом
+        return self.transcribe_batch([left_channel, right_channel])
@@ -1,5 +1,8 @@
+import atexit
+import queue
 import uvicorn.logging as u_logging
 import logging
+from logging.handlers import QueueHandler, QueueListener
 
 FORMAT: str = "%(levelprefix)s %(asctime)s [%(threadName)s]  [%(name)s]  %(message)s"
 
@@ -9,7 +12,13 @@ console_handler = logging.StreamHandler()
 console_handler.setLevel(logging.DEBUG)
 formatter = u_logging.DefaultFormatter(FORMAT, datefmt="%Y-%m-%d %H:%M:%S")
 console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
+# Форматирование и запись в консоль выполняются в фоновом потоке слушателя,
+# вызывающий поток (в том числе event loop) только кладет запись в очередь
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+logger.addHandler(QueueHandler(log_queue))
+log_listener = QueueListener(log_queue, console_handler, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
 
 
 class Logger:
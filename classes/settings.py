@@ -1,5 +1,6 @@
 import ipaddress
-from typing import List
+import os
+from typing import List, Optional
 from urllib.parse import quote_plus
 
 from pydantic import PostgresDsn
@@ -15,6 +16,14 @@ class Settings(BaseSettings):
     DB_PORT: int = 5432
     DB_DB: str = "speech-analyzer"
     API_ROOT: str = "/api"
+    # Количество процессов uvicorn при запуске через main.py; 0 — 2 * CPU + 1
+    API_WORKERS: int = 1
+    # Процесс-планировщик выполняет миграции и запускает потоки распознавания и анализа.
+    # При нескольких процессах API он должен быть ровно один: остальные запускаются с SCHEDULER_ROLE=0,
+    # main.py не запускает несколько процессов с этой ролью. Не задан — только при одном процессе API
+    SCHEDULER_ROLE: Optional[bool] = None
+    # Размер пула потоков для синхронных обработчиков маршрутов
+    API_THREADS: int = 128
 
     # Настройки IP-фильтрации
     ALLOWED_IPS: str = "127.0.0.1,::1,localhost"
@@ -48,6 +57,18 @@ class Settings(BaseSettings):
                 networks.append(ip)  # для hostnames like localhost
         return networks
 
+    @property
+    def api_workers(self) -> int:
+        """Возвращает количество процессов uvicorn"""
+        return self.API_WORKERS or (os.cpu_count() or 1) * 2 + 1
+
+    @property
+    def scheduler_role(self) -> bool:
+        """Запускает ли процесс планировщик: по умолчанию только при одном процессе API"""
+        if self.SCHEDULER_ROLE is None:
+            return self.api_workers == 1
+        return self.SCHEDULER_ROLE
+
     # Автоматически создаем DSN строку
     @property
     def database_url(self) -> PostgresDsn:
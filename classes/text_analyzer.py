@@ -1,19 +1,107 @@
 # services/text_analyzer.py
 import logging
-from typing import List, Dict, Optional, Tuple, Set
-from pydantic import BaseModel, Field
+import multiprocessing
+import os
+from bisect import bisect_left, bisect_right, insort
+from typing import List, Dict, Iterable, NamedTuple, Optional, Tuple, Set
+from pydantic import BaseModel, ConfigDict, Field
+import ahocorasick
 import pymorphy3
-from rapidfuzz import fuzz, process
 import re
-from functools import lru_cache
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
 from entities.dictionary_entity import DictionaryType
 from models.conversation_model import ConversationAnalysis, ConversationHighlight, ConversationModel
 from models.recognizer_models import Utterance
 
 logger = logging.getLogger(__name__)
 
+# Разговоры короче этого анализируются в текущем процессе: запуск задач в пуле дороже самого анализа
+PARALLEL_MIN_UTTERANCES = 8
+PARALLEL_CHUNK_SIZE = 16
+# Сколько последних наборов словарей хранятся предобработанными (с автоматами)
+PREPROCESSED_CACHE_SIZE = 4
+# Сколько нормальных форм слов хранит кэш морфологии; новые слова сверх лимита нормализуются без кэширования
+WORD_CACHE_SIZE = 200000
+
+# Слово в тексте: компилируется один раз для всех анализаторов
+_WORD_RE = re.compile(r'\b\w+\b')
+
+_STOP_WORDS: frozenset[str] = frozenset({
+    "я", "мне", "меня", "ты", "тебе", "тебя", "он", "его", "ей", "она",
+    "мы", "нам", "нас", "вы", "вам", "вас", "они", "им", "их",
+    "в", "на", "за", "под", "над", "от", "до", "из", "к", "по", "со", "у",
+    "и", "а", "но", "да", "или", "ли", "же", "бы", "вот", "всё", "все",
+    "не", "ни", "как", "так", "то", "это", "что", "чтоб", "чтобы", "для",
+    "о", "об", "про", "с", "со", "из-за", "из", "от", "до", "по", "под",
+    "над", "перед", "при", "через", "сквозь", "между", "среди", "вокруг"
+})
+
+
+def _is_word_char(char: str) -> bool:
+    """Символ входит в \\w (буква, цифра или подчеркивание)"""
+    return char.isalnum() or char == '_'
+
+
+def _is_word_boundary(text: str, pos: int) -> bool:
+    """Аналог \\b: на позиции pos символ слева и справа различаются принадлежностью к \\w"""
+    before = pos > 0 and _is_word_char(text[pos - 1])
+    after = pos < len(text) and _is_word_char(text[pos])
+    return before != after
+
+
+def _find_bounded(needle: str, text: str) -> List[Tuple[int, int]]:
+    """Непересекающиеся вхождения needle в text по границам слов, как finditer с \\b"""
+    if not needle:
+        return []
+
+    positions = []
+    needle_len = len(needle)
+    pos = text.find(needle)
+    while pos != -1:
+        end = pos + needle_len
+        if _is_word_boundary(text, pos) and _is_word_boundary(text, end):
+            positions.append((pos, end))
+            pos = text.find(needle, end)
+        else:
+            pos = text.find(needle, pos + 1)
+    return positions
+
+
+def _build_automaton(phrases: List[str]) -> ahocorasick.Automaton:
+    """Строит автомат Ахо-Корасик, значением каждого ключа служит сама фраза"""
+    automaton = ahocorasick.Automaton()
+    for phrase in phrases:
+        if phrase:
+            automaton.add_word(phrase, phrase)
+    if len(automaton) > 0:
+        automaton.make_automaton()
+    return automaton
+
+
+def _find_automaton_matches(automaton: ahocorasick.Automaton, text: str) -> Dict[str, List[Tuple[int, int]]]:
+    """
+    Один проход автомата по тексту: {фраза: [(start, end), ...]}.
+    Как и finditer с \\b, учитывает границы слов и не возвращает пересекающиеся вхождения одной фразы.
+    """
+    matches: Dict[str, List[Tuple[int, int]]] = {}
+    if len(automaton) == 0:
+        return matches
+
+    for end_idx, phrase in automaton.iter(text):
+        start, end = end_idx - len(phrase) + 1, end_idx + 1
+        if not (_is_word_boundary(text, start) and _is_word_boundary(text, end)):
+            continue
+        positions = matches.setdefault(phrase, [])
+        if not positions or start >= positions[-1][1]:
+            positions.append((start, end))
+    return matches
+
 
 class MatchHighlight(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     phrase: str
     start_pos: int
     end_pos: int
@@ -29,58 +117,68 @@ class AnalysisResult(BaseModel):
     highlights: List[ConversationHighlight] = Field(default_factory=list)
     text_with_highlights: Optional[str] = None
 
-    def model_dump(self, *args, **kwargs):
-        return {
-            'matched_phrases': self.matched_phrases,
-            'rude_words': self.rude_words,
-            'greetings': self.greetings,
-            'other_matches': self.other_matches,
-            'highlights': [highlight.model_dump() for highlight in self.highlights],
-            'text_with_highlights': self.text_with_highlights
-        }
+
+class PreprocessedState(NamedTuple):
+    """
+    Предобработанный набор словарей с автоматами и версией.
+    Не изменяется после создания: анализатор заменяет его целиком, а анализ читает один раз,
+    поэтому словари и автоматы разных наборов не смешиваются между потоками
+    """
+    dictionaries: Optional[List[Dict]]
+    signature: Optional[Tuple]
+    preprocessed_dictionaries: Dict
+    exact_automaton: ahocorasick.Automaton
+    normalized_automaton: ahocorasick.Automaton
+    version: int
 
 
 class EnhancedMorphAnalyzer:
     """Улучшенный морфологический анализатор с кэшированием"""
 
+    __slots__ = ('morph', 'stop_words', 'normal_forms')
+
     def __init__(self):
         self.morph = pymorphy3.MorphAnalyzer()
-        self.normalize_cache = {}
-        self.phrase_normalize_cache = {}
-        self.stop_words = {
-            "я", "мне", "меня", "ты", "тебе", "тебя", "он", "его", "ей", "она",
-            "мы", "нам", "нас", "вы", "вам", "вас", "они", "им", "их",
-            "в", "на", "за", "под", "над", "от", "до", "из", "к", "по", "со", "у",
-            "и", "а", "но", "да", "или", "ли", "же", "бы", "вот", "всё", "все",
-            "не", "ни", "как", "так", "то", "это", "что", "чтоб", "чтобы", "для",
-            "о", "об", "про", "с", "со", "из-за", "из", "от", "до", "по", "под",
-            "над", "перед", "при", "через", "сквозь", "между", "среди", "вокруг"
-        }
-
-    @lru_cache(maxsize=10000)
+        self.stop_words = _STOP_WORDS
+        # Кэш нормальных форм слов: нормализация чистая, поэтому хватает обычного словаря
+        self.normal_forms: Dict[str, str] = {}
+
     def normalize_word(self, word: str) -> str:
         """Нормализация одного слова"""
-        try:
-            parsed = self.morph.parse(word)[0]
-            return parsed.normal_form
-        except:
-            return word.lower()
+        normal_form = self.normal_forms.get(word)
+        if normal_form is None:
+            try:
+                # normal_forms не строит объекты Parse, первая форма совпадает с parse(word)[0].normal_form
+                normal_form = self.morph.normal_forms(word)[0]
+            except:
+                normal_form = word.lower()
+            if len(self.normal_forms) < WORD_CACHE_SIZE:
+                self.normal_forms[word] = normal_form
+        return normal_form
+
+    def prime_words(self, texts: Iterable[str]) -> None:
+        """
+        Нормализует уникальные слова набора текстов одним проходом до анализа,
+        после чего normalize_phrase берет их нормальные формы из кэша.
+        """
+        normal_forms = self.normal_forms
+        for word in {word for text in texts for word in _WORD_RE.findall(text.lower())}:
+            if word not in normal_forms:
+                self.normalize_word(word)
 
     def normalize_phrase(self, phrase: str) -> str:
-        """Нормализация целой фразы с кэшированием"""
-        if phrase in self.phrase_normalize_cache:
-            return self.phrase_normalize_cache[phrase]
-
-        words = re.findall(r'\b\w+\b', phrase.lower())
-        normalized_words = [self.normalize_word(word) for word in words]
-        result = ' '.join(normalized_words)
-
-        self.phrase_normalize_cache[phrase] = result
-        return result
+        """
+        Нормализация целой фразы.
+        Кэшируются только нормальные формы слов: тексты высказываний почти не повторяются.
+        """
+        normal_forms = self.normal_forms
+        words = _WORD_RE.findall(phrase.lower())
+        normalized_words = [normal_forms.get(word) or self.normalize_word(word) for word in words]
+        return ' '.join(normalized_words)
 
     def get_phrase_keywords(self, phrase: str) -> Set[str]:
         """Извлечение ключевых слов из фразы (исключая стоп-слова)"""
-        words = re.findall(r'\b\w+\b', phrase.lower())
+        words = _WORD_RE.findall(phrase.lower())
         keywords = {self.normalize_word(word) for word in words
                     if len(word) > 2 and word not in self.stop_words}
         return keywords
@@ -95,35 +193,59 @@ class EnhancedTextAnalyzer:
 
     def __init__(self):
         self.morph = EnhancedMorphAnalyzer()
-        self.word_pattern = re.compile(r'\b\w+\b')
+        self.word_pattern = _WORD_RE
 
     def find_exact_phrase_positions(self, phrase: str, text: str) -> List[Tuple[int, int]]:
         """Точный поиск позиций фразы с учетом границ слов"""
-        # Используем границы слов для точного поиска
-        pattern = re.compile(r'\b' + re.escape(phrase) + r'\b', re.IGNORECASE)
-        return [(match.start(), match.end()) for match in pattern.finditer(text)]
+        # Подстрочный поиск str.find вместо компиляции регулярного выражения на каждый вызов
+        return _find_bounded(phrase.lower(), text.lower())
 
-    def find_normalized_phrase_positions(self, phrase: str, text: str) -> List[Tuple[int, int]]:
-        """Поиск позиций нормализованной фразы с учетом границ слов"""
-        norm_phrase = self.morph.normalize_phrase(phrase)
-        norm_text = self.morph.normalize_phrase(text)
+    def find_normalized_phrase_positions(self, phrase: str, text: str, norm_phrase: Optional[str] = None,
+                                         norm_text: Optional[str] = None) -> List[Tuple[int, int]]:
+        """
+        Поиск позиций нормализованной фразы с учетом границ слов.
+        Уже нормализованные фразу и текст можно передать, чтобы не нормализовать их повторно.
+        """
+        if norm_phrase is None:
+            norm_phrase = self.morph.normalize_phrase(phrase)
+        if norm_text is None:
+            norm_text = self.morph.normalize_phrase(text)
 
         # Ищем нормализованную фразу в нормализованном тексте с границами слов
-        pattern = re.compile(r'\b' + re.escape(norm_phrase) + r'\b', re.IGNORECASE)
-        matches = list(pattern.finditer(norm_text))
+        # (нормальные формы pymorphy3 уже в нижнем регистре, регулярное выражение не нужно)
+        norm_positions = _find_bounded(norm_phrase, norm_text)
 
-        if not matches:
+        # Преобразуем позиции из нормализованного текста в оригинальный
+        return self.map_normalized_positions(norm_positions, norm_text, text)
+
+    @staticmethod
+    def get_word_starts(norm_text: str) -> List[int]:
+        """Начала слов нормализованного текста: слова разделены одним пробелом"""
+        word_starts = []
+        offset = 0
+        for word in norm_text.split(' '):
+            word_starts.append(offset)
+            offset += len(word) + 1
+        return word_starts
+
+    def map_normalized_positions(self, norm_positions: List[Tuple[int, int]], norm_text: str, text: str,
+                                 norm_word_starts: Optional[List[int]] = None,
+                                 text_words: Optional[List[re.Match]] = None) -> List[Tuple[int, int]]:
+        """
+        Переводит позиции в нормализованном тексте в позиции оригинального текста по индексам слов.
+        Начала слов нормализованного текста и слова оригинала можно передать, чтобы не считать их для каждой фразы.
+        """
+        if not norm_positions:
             return []
 
-        # Преобразуем позиции из нормализованного текста в оригинальный
+        word_starts = norm_word_starts if norm_word_starts is not None else self.get_word_starts(norm_text)
+        if text_words is None:
+            text_words = list(self.word_pattern.finditer(text))
         original_positions = []
-        text_words = list(self.word_pattern.finditer(text))
-        norm_text_words = list(self.word_pattern.finditer(norm_text))
-
-        for match in matches:
-            # Находим соответствующие слова в оригинальном тексте
-            start_idx = len(norm_text[:match.start()].split())
-            end_idx = len(norm_text[:match.end()].split())
+        for norm_start, norm_end in norm_positions:
+            # Количество слов, начинающихся до позиции
+            start_idx = bisect_left(word_starts, norm_start)
+            end_idx = bisect_left(word_starts, norm_end)
 
             if start_idx < len(text_words) and end_idx <= len(text_words):
                 start_pos = text_words[start_idx].start()
@@ -132,14 +254,40 @@ class EnhancedTextAnalyzer:
 
         return original_positions
 
-    def find_contextual_phrase_positions(self, phrase: str, text: str, threshold: float = 0.75) -> List[
-        Tuple[int, int]]:
-        """Поиск фраз в контексте с учетом ключевых слов (только для анализа, не для подсветки)"""
-        norm_phrase = self.morph.normalize_phrase(phrase)
-        norm_text = self.morph.normalize_phrase(text)
+    def get_contextual_keywords(self, norm_phrase: str) -> Optional[frozenset]:
+        """
+        Ключевые слова нормализованной фразы, которые ищет контекстуальный поиск.
+        None для фраз из одного слова: для них контекстуальный поиск не выполняется.
+        """
+        phrase_words = norm_phrase.split()
+        if len(phrase_words) < 2:
+            return None
+        return frozenset(word for word in phrase_words if not self.morph.is_stop_word(word))
+
+    @staticmethod
+    def get_word_indexes(norm_text: str) -> Dict[str, List[int]]:
+        """Индексы вхождений каждого слова нормализованного текста: {слово: [индекс слова, ...]}"""
+        word_indexes: Dict[str, List[int]] = {}
+        for idx, word in enumerate(norm_text.split()):
+            word_indexes.setdefault(word, []).append(idx)
+        return word_indexes
+
+    def find_contextual_phrase_positions(self, phrase: str, text: str, threshold: float = 0.75,
+                                         norm_phrase: Optional[str] = None,
+                                         norm_text: Optional[str] = None,
+                                         norm_word_indexes: Optional[Dict[str, List[int]]] = None,
+                                         text_words: Optional[List[re.Match]] = None) -> List[Tuple[int, int]]:
+        """
+        Поиск фраз в контексте с учетом ключевых слов (только для анализа, не для подсветки).
+        Уже нормализованные фразу и текст, индексы слов и слова оригинала можно передать,
+        чтобы не вычислять их повторно для каждой фразы.
+        """
+        if norm_phrase is None:
+            norm_phrase = self.morph.normalize_phrase(phrase)
+        if norm_text is None:
+            norm_text = self.morph.normalize_phrase(text)
 
         phrase_words = norm_phrase.split()
-        text_words = norm_text.split()
 
         if len(phrase_words) < 2:
             return []
@@ -150,17 +298,11 @@ class EnhancedTextAnalyzer:
         if not keywords:
             return []
 
-        # Ищем позиции ключевых слов в тексте с учетом границ слов
-        keyword_positions = {}
-        for keyword in keywords:
-            # Используем границы слов для поиска ключевых слов
-            pattern = re.compile(r'\b' + re.escape(keyword) + r'\b', re.IGNORECASE)
-            for match in pattern.finditer(norm_text):
-                word_start = match.start()
-                word_idx = len(norm_text[:word_start].split())
-                if keyword not in keyword_positions:
-                    keyword_positions[keyword] = []
-                keyword_positions[keyword].append(word_idx)
+        # Индексы слов, на которых встречаются ключевые слова: поиск по словарю вместо регулярного выражения
+        if norm_word_indexes is None:
+            norm_word_indexes = self.get_word_indexes(norm_text)
+        keyword_positions = {keyword: norm_word_indexes[keyword]
+                             for keyword in keywords if keyword in norm_word_indexes}
 
         # Проверяем, есть ли все ключевые слова в тексте
         if len(keyword_positions) < len(keywords):
@@ -168,6 +310,8 @@ class EnhancedTextAnalyzer:
 
         # Ищем последовательности, где ключевые слова идут в правильном порядке
         positions = []
+        if text_words is None:
+            text_words = list(self.word_pattern.finditer(text))
 
         # Для каждого вхождения первого ключевого слова
         first_keyword = keywords[0]
@@ -179,97 +323,94 @@ class EnhancedTextAnalyzer:
                 # Проверяем, идут ли остальные ключевые слова в правильном порядке
                 for keyword in keywords[1:]:
                     if keyword in keyword_positions:
-                        # Ищем следующее ключевое слово после current_idx
-                        found = False
-                        for next_idx in keyword_positions[keyword]:
-                            if next_idx > current_idx:
-                                current_idx = next_idx
-                                matched_keywords.append(keyword)
-                                found = True
-                                break
-                        if not found:
+                        # Ищем следующее ключевое слово после current_idx (индексы отсортированы)
+                        indexes = keyword_positions[keyword]
+                        next_pos = bisect_right(indexes, current_idx)
+                        if next_pos == len(indexes):
                             break
+                        current_idx = indexes[next_pos]
+                        matched_keywords.append(keyword)
 
                 # Если нашли все ключевые слова в правильном порядке
                 if len(matched_keywords) == len(keywords):
                     # Находим позиции в оригинальном тексте
-                    text_matches = list(self.word_pattern.finditer(text))
-                    if start_idx < len(text_matches) and current_idx < len(text_matches):
-                        start_pos = text_matches[start_idx].start()
-                        end_pos = text_matches[current_idx].end()
+                    if start_idx < len(text_words) and current_idx < len(text_words):
+                        start_pos = text_words[start_idx].start()
+                        end_pos = text_words[current_idx].end()
                         positions.append((start_pos, end_pos))
 
         return positions
 
-    def is_phrase_in_text(self, phrase: str, text: str, threshold: float = 0.9) -> Tuple[
-        bool, str, List[Tuple[int, int]]]:
+    def is_phrase_in_text(self, phrase: str, text: str, threshold: float = 0.9, norm_phrase: Optional[str] = None,
+                          norm_text: Optional[str] = None,
+                          norm_words: Optional[frozenset] = None) -> Tuple[bool, str, List[Tuple[int, int]]]:
         """
         Проверка вхождения фразы с учетом морфологии
-        Возвращает разные типы совпадений для анализа
+        Возвращает разные типы совпадений для анализа.
+        При проверке многих фраз по одному тексту нормализованный текст и множество его слов
+        стоит вычислить один раз и передать в norm_text и norm_words.
         """
+        # Нормализуем фразу и текст один раз для всех видов поиска
+        if norm_phrase is None:
+            norm_phrase = self.morph.normalize_phrase(phrase)
+        if norm_text is None:
+            norm_text = self.morph.normalize_phrase(text)
+
         # 1. Точное совпадение с границами слов
         exact_positions = self.find_exact_phrase_positions(phrase, text)
         if exact_positions:
             return True, "exact", exact_positions
 
         # 2. Нормализованное совпадение с границами слов
-        normalized_positions = self.find_normalized_phrase_positions(phrase, text)
+        normalized_positions = self.find_normalized_phrase_positions(phrase, text, norm_phrase, norm_text)
         if normalized_positions:
             return True, "normalized", normalized_positions
 
-        # 3. Контекстуальное совпадение (только для анализа, не для подсветки)
-        contextual_positions = self.find_contextual_phrase_positions(phrase, text, threshold)
-        if contextual_positions:
-            return True, "contextual", contextual_positions
+        # 3. Контекстуальное совпадение (только для анализа, не для подсветки),
+        # если все ключевые слова фразы есть среди слов текста
+        keywords = self.get_contextual_keywords(norm_phrase)
+        if norm_words is None:
+            norm_words = frozenset(norm_text.split())
+        if keywords and keywords <= norm_words:
+            contextual_positions = self.find_contextual_phrase_positions(phrase, text, threshold, norm_phrase,
+                                                                         norm_text)
+            if contextual_positions:
+                return True, "contextual", contextual_positions
 
         return False, "none", []
 
     def add_highlights_to_text(self, text: str, highlights: List[ConversationHighlight]) -> str:
-        """Добавление подсветок с обработкой пересечений"""
+        """
+        Добавление подсветок с обработкой пересечений.
+        Подсветки должны быть отсортированы по start_pos: analyze_utterance вставляет их сразу по порядку.
+        """
         if not highlights:
             return text
 
-        # Сортируем подсветки по начальной позиции
-        sorted_highlights = sorted(highlights, key=lambda x: x.start_pos)
-
-        # Обрабатываем пересекающиеся подсветки
-        merged_highlights = []
-        current_highlight = None
-
-        for highlight in sorted_highlights:
-            if current_highlight is None:
-                current_highlight = highlight
-            elif highlight.start_pos <= current_highlight.end_pos:
-                # Объединяем пересекающиеся подсветки
-                current_highlight = ConversationHighlight(
-                    phrase=f"{current_highlight.phrase}|{highlight.phrase}",
-                    start_pos=min(current_highlight.start_pos, highlight.start_pos),
-                    end_pos=max(current_highlight.end_pos, highlight.end_pos),
-                    dictionary_name=current_highlight.dictionary_name,
-                    dictionary_id=current_highlight.dictionary_id,
-                    dictionary_color=current_highlight.dictionary_color,
-                    match_type="merged"
-                )
-            else:
-                merged_highlights.append(current_highlight)
-                current_highlight = highlight
-
-        if current_highlight:
-            merged_highlights.append(current_highlight)
-
-        # Быстрое построение результата
+        # Один проход по отсортированным подсветкам: пересекающиеся объединяются по смещениям
+        # в одну метку с оформлением первой, без создания промежуточных объектов
         result_parts = []
         last_pos = 0
+        index = 0
+        count = len(highlights)
+
+        while index < count:
+            first = highlights[index]
+            end_pos = first.end_pos
+            match_type = first.match_type
+            index += 1
+            while index < count and highlights[index].start_pos <= end_pos:
+                end_pos = max(end_pos, highlights[index].end_pos)
+                match_type = "merged"
+                index += 1
+
+            if first.start_pos > last_pos:
+                result_parts.append(text[last_pos:first.start_pos])
 
-        for highlight in merged_highlights:
-            if highlight.start_pos > last_pos:
-                result_parts.append(text[last_pos:highlight.start_pos])
-
-            highlighted_text = text[highlight.start_pos:highlight.end_pos]
             result_parts.append(
-                f'<mark style="background-color:{highlight.dictionary_color or "#cccccc"}" class="match {highlight.match_type}" data-dict-name="{highlight.dictionary_name}" data-dict="{highlight.dictionary_id}">{highlighted_text}</mark>'
+                f'<mark style="background-color:{first.dictionary_color or "#cccccc"}" class="match {match_type}" data-dict-name="{first.dictionary_name}" data-dict="{first.dictionary_id}">{text[first.start_pos:end_pos]}</mark>'
             )
-            last_pos = highlight.end_pos
+            last_pos = end_pos
 
         if last_pos < len(text):
             result_parts.append(text[last_pos:])
@@ -280,42 +421,223 @@ class EnhancedTextAnalyzer:
 class TextAnalyzer:
     """Основной класс анализатора с улучшенной морфологией"""
 
-    def __init__(self):
+    def __init__(self, analysis_cache_size: int = 4096, max_workers: Optional[int] = None):
+        """
+        :param analysis_cache_size: Размер LRU-кэша результатов анализа высказываний
+        :param max_workers: Количество процессов для пакетного анализа (по умолчанию по числу ядер), 1 — без пула
+        """
         self.enhanced_analyzer = EnhancedTextAnalyzer()
-        self.preprocessed_dictionaries = {}
-
-        # Кэш анализа
-        self.analysis_cache = {}
+        # Текущий предобработанный набор словарей. Версия своя у каждого набора и входит в ключ кэша,
+        # по отпечатку содержимого новый список с тем же содержимым не обрабатывается заново
+        self._state = PreprocessedState(
+            dictionaries=None,
+            signature=None,
+            preprocessed_dictionaries={},
+            exact_automaton=_build_automaton([]),
+            normalized_automaton=_build_automaton([]),
+            version=0
+        )
+        self._last_version = 0
+        # Предобработанные наборы словарей по отпечатку: возврат к недавнему набору не строит автоматы заново
+        self._preprocessed_cache: OrderedDict[Tuple, PreprocessedState] = OrderedDict()
+        # Проверка, предобработка и замена набора словарей атомарны для потоков TaskProcessor
+        self._state_lock = Lock()
+
+        # Кэш анализа (LRU: при переполнении вытесняется самая старая запись)
+        self.analysis_cache: OrderedDict[Tuple[str, str, int], AnalysisResult] = OrderedDict()
+        self.analysis_cache_size = analysis_cache_size
         self.cache_hits = 0
         self.cache_misses = 0
+        # Анализатор общий для потоков TaskProcessor: проверка, перестановка и вытеснение в LRU атомарны
+        self._cache_lock = Lock()
+
+        # Пул процессов для пакетного анализа, пересоздается при смене словарей
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_version: Optional[int] = None
+        self._pool_lock = Lock()
+
+    @staticmethod
+    def _get_cache_key(utterance: Utterance, version: int) -> Tuple[str, str, int]:
+        """Говорящий входит в ключ: словари CLIENT/OPERATOR применяются только к своей стороне"""
+        return utterance.text, utterance.speaker, version
+
+    def _get_cached(self, cache_key: Tuple[str, str, int]) -> Optional[AnalysisResult]:
+        """Возвращает результат из LRU-кэша и отмечает его как недавно использованный"""
+        with self._cache_lock:
+            result = self.analysis_cache.get(cache_key)
+            if result is None:
+                self.cache_misses += 1
+            else:
+                self.cache_hits += 1
+                self.analysis_cache.move_to_end(cache_key)
+            return result
+
+    def _store_result(self, cache_key: Tuple[str, str, int], result: AnalysisResult) -> None:
+        """Сохраняет результат в LRU-кэш, вытесняя одну самую старую запись при переполнении"""
+        with self._cache_lock:
+            self.analysis_cache[cache_key] = result
+            self.analysis_cache.move_to_end(cache_key)
+            if len(self.analysis_cache) > self.analysis_cache_size:
+                self.analysis_cache.popitem(last=False)
+
+    def _get_pool(self, state: PreprocessedState) -> ProcessPoolExecutor:
+        """
+        Возвращает пул процессов, в каждом из которых предобработан набор словарей state.
+        Процессы получают готовое состояние предобработки (с автоматами) и не нормализуют фразы заново.
+        Процессы порождаются через forkserver: в родителе работают потоки, соединения с БД и модель Whisper,
+        копировать их через fork небезопасно, а сервер запускается чистым один раз.
+        Сервер заранее импортирует этот модуль с точками входа процессов (_init_worker, _analyze_in_worker).
+        Каждый процесс пула при запуске все равно выполняет главный модуль родителя как __mp_main__,
+        поэтому приложение собирается в application.py, а main.py только запускает uvicorn.
+        """
+        with self._pool_lock:
+            if self._pool is None or self._pool_version != state.version:
+                if self._pool is not None:
+                    # Уже отправленные задачи старого пула доработают
+                    self._pool.shutdown(wait=False)
+                mp_context = multiprocessing.get_context("forkserver")
+                # Действует до запуска сервера, то есть для первого пула процесса
+                mp_context.set_forkserver_preload(["classes.text_analyzer"])
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=mp_context,
+                    initializer=_init_worker,
+                    initargs=(state,)
+                )
+                self._pool_version = state.version
+            return self._pool
+
+    def close(self) -> None:
+        """Останавливает пул процессов пакетного анализа"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
+                self._pool_version = None
+
+    @staticmethod
+    def get_dictionaries_signature(dictionaries: List[Dict]) -> Tuple:
+        """Отпечаток всего, что влияет на результат анализа: состав, тип, оформление и фразы словарей"""
+        return tuple(
+            (dictionary["id"], dictionary["name"], dictionary["color"], dictionary["type"],
+             tuple(dictionary["phrases"]))
+            for dictionary in dictionaries
+        )
+
+    def ensure_preprocessed(self, dictionaries: List[Dict]) -> PreprocessedState:
+        """
+        Предобрабатывает словари, если они отличаются от уже обработанных, и возвращает их состояние.
+        Для того же списка проверка бесплатна, для нового списка сравнивается отпечаток содержимого:
+        при совпадении версия не меняется и кэш анализа остается действительным.
+        Проверка и замена состояния выполняются под одной блокировкой.
+        """
+        state = self._state
+        if dictionaries is state.dictionaries:
+            return state
+        with self._state_lock:
+            state = self._state
+            if dictionaries is state.dictionaries:
+                return state
+            signature = self.get_dictionaries_signature(dictionaries)
+            if signature == state.signature:
+                state = state._replace(dictionaries=dictionaries)
+            elif signature in self._preprocessed_cache:
+                # Набор уже обрабатывался: восстанавливаем его вместе с версией, кэш анализа для него снова действителен
+                self._preprocessed_cache.move_to_end(signature)
+                state = self._preprocessed_cache[signature]._replace(dictionaries=dictionaries)
+            else:
+                state = self.preprocess_dictionaries(dictionaries, signature)
+            self._state = state
+            return state
 
-    def preprocess_dictionaries(self, dictionaries: List[Dict]) -> None:
-        """Предварительная обработка словарей"""
-        self.preprocessed_dictionaries = {}
+    def get_preprocessed_state(self) -> PreprocessedState:
+        """Состояние предобработки словарей для передачи в процессы пула (автоматы сериализуются pickle)"""
+        return self._state
+
+    def load_preprocessed_state(self, state: PreprocessedState) -> None:
+        """Принимает состояние из get_preprocessed_state вместо повторной предобработки словарей"""
+        with self._state_lock:
+            self._state = state
+
+    def preprocess_dictionaries(self, dictionaries: List[Dict], signature: Optional[Tuple] = None) -> PreprocessedState:
+        """
+        Предварительная обработка словарей: строит новое состояние с очередной версией и запоминает его.
+        Вызывается под _state_lock, текущее состояние заменяет ensure_preprocessed.
+        """
+        preprocessed_dictionaries = {}
         for dictionary in dictionaries:
             dict_id = dictionary["id"]
-            self.preprocessed_dictionaries[dict_id] = {
+            preprocessed_dictionaries[dict_id] = {
                 'original': dictionary,
+                'lowered_phrases': [phrase.lower() for phrase in dictionary["phrases"]],
+                # Для коротких фраз (1-2 слова) используем более строгий порог
+                'thresholds': [0.95 if len(phrase.split()) <= 2 else 0.9 for phrase in dictionary["phrases"]],
                 'normalized_phrases': [self.enhanced_analyzer.morph.normalize_phrase(phrase)
                                        for phrase in dictionary["phrases"]],
                 'phrase_keywords': [self.enhanced_analyzer.morph.get_phrase_keywords(phrase)
                                     for phrase in dictionary["phrases"]]
             }
+            preprocessed_dictionaries[dict_id]['contextual_keywords'] = [
+                self.enhanced_analyzer.get_contextual_keywords(norm_phrase)
+                for norm_phrase in preprocessed_dictionaries[dict_id]['normalized_phrases']
+            ]
+
+        if signature is None:
+            signature = self.get_dictionaries_signature(dictionaries)
+        self._last_version += 1
+        state = PreprocessedState(
+            dictionaries=dictionaries,
+            signature=signature,
+            preprocessed_dictionaries=preprocessed_dictionaries,
+            # Автоматы по фразам всех словарей: в нижнем регистре (точный поиск) и нормализованным
+            exact_automaton=_build_automaton([
+                low_phrase
+                for preprocessed in preprocessed_dictionaries.values()
+                for low_phrase in preprocessed['lowered_phrases']
+            ]),
+            normalized_automaton=_build_automaton([
+                norm_phrase
+                for preprocessed in preprocessed_dictionaries.values()
+                for norm_phrase in preprocessed['normalized_phrases']
+            ]),
+            version=self._last_version
+        )
+
+        self._preprocessed_cache[signature] = state
+        self._preprocessed_cache.move_to_end(signature)
+        if len(self._preprocessed_cache) > PREPROCESSED_CACHE_SIZE:
+            self._preprocessed_cache.popitem(last=False)
+        return state
 
     def analyze_utterance(self, utterance: Utterance, dictionaries: List[Dict]) -> AnalysisResult:
         """Улучшенный анализ высказывания с учетом морфологии"""
-        cache_key = f"{utterance.text}_{hash(str(dictionaries))}"
+        # Предварительная обработка словарей, если не сделана для этого набора
+        return self._analyze_utterance(utterance, dictionaries, self.ensure_preprocessed(dictionaries))
+
+    def _analyze_utterance(self, utterance: Utterance, dictionaries: List[Dict],
+                           state: PreprocessedState) -> AnalysisResult:
+        """Анализ высказывания по одному снимку словарей: ключ кэша, словари и автоматы из одного набора"""
+        cache_key = self._get_cache_key(utterance, state.version)
 
-        if cache_key in self.analysis_cache:
-            self.cache_hits += 1
-            return self.analysis_cache[cache_key]
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return cached
 
-        self.cache_misses += 1
         result = AnalysisResult()
 
-        # Предварительная обработка словарей, если не сделана
-        if not self.preprocessed_dictionaries:
-            self.preprocess_dictionaries(dictionaries)
+        # Высказывание нормализуется один раз, фразы словарей уже нормализованы при предобработке
+        morph = self.enhanced_analyzer.morph
+        norm_text = morph.normalize_phrase(utterance.text)
+        # По одному проходу автоматов находят все точные и все нормализованные вхождения фраз
+        exact_matches = _find_automaton_matches(state.exact_automaton, utterance.text.lower())
+        normalized_matches = _find_automaton_matches(state.normalized_automaton, norm_text)
+        # Множество слов высказывания: контекстуальный поиск нужен только фразам, все ключевые слова которых в нем есть
+        norm_words = frozenset(norm_text.split())
+        # Разметка слов считается один раз на высказывание и используется при переводе позиций всех фраз
+        norm_word_starts = self.enhanced_analyzer.get_word_starts(norm_text)
+        text_words = list(_WORD_RE.finditer(utterance.text))
+        norm_word_indexes = self.enhanced_analyzer.get_word_indexes(norm_text)
 
         # Анализ для каждого словаря
         for dictionary in dictionaries:
@@ -324,16 +646,30 @@ class TextAnalyzer:
                     or (dict_type == DictionaryType.OPERATOR and utterance.speaker != "operator")):
                 continue
 
+            preprocessed = state.preprocessed_dictionaries[dictionary["id"]]
             matched = []
-            for phrase in dictionary["phrases"]:
-                # Для коротких фраз (1-2 слова) используем более строгий порог
-                phrase_word_count = len(phrase.split())
-                threshold = 0.95 if phrase_word_count <= 2 else 0.9
-
-                found, match_type, positions = self.enhanced_analyzer.is_phrase_in_text(phrase, utterance.text,
-                                                                                        threshold)
-
-                if found:
+            for phrase, low_phrase, norm_phrase, keywords, threshold in zip(dictionary["phrases"],
+                                                                            preprocessed['lowered_phrases'],
+                                                                            preprocessed['normalized_phrases'],
+                                                                            preprocessed['contextual_keywords'],
+                                                                            preprocessed['thresholds']):
+                # 1. Точное и 2. нормализованное совпадение (из автоматов), 3. контекстуальное
+                match_type = "exact"
+                positions = exact_matches.get(low_phrase, [])
+                if not positions:
+                    match_type = "normalized"
+                    positions = self.enhanced_analyzer.map_normalized_positions(
+                        normalized_matches.get(norm_phrase, []), norm_text, utterance.text,
+                        norm_word_starts, text_words
+                    )
+                if not positions and keywords and keywords <= norm_words:
+                    match_type = "contextual"
+                    positions = self.enhanced_analyzer.find_contextual_phrase_positions(
+                        phrase, utterance.text, threshold, norm_phrase, norm_text,
+                        norm_word_indexes, text_words
+                    )
+
+                if positions:
                     # ДЛЯ ПОДСВЕТКИ: добавляем только точные и нормализованные совпадения
                     # contextual оставляем только для анализа, но не для визуализации
                     if match_type in ["exact", "normalized"]:
@@ -343,12 +679,11 @@ class TextAnalyzer:
                             found_text = utterance.text[start_pos:end_pos]
                             # Проверяем, что найденный текст соответствует фразе
                             if match_type == "exact":
-                                if found_text.lower() != phrase.lower():
+                                if found_text.lower() != low_phrase:
                                     valid_match = False
                                     break
                             elif match_type == "normalized":
-                                norm_phrase = self.enhanced_analyzer.morph.normalize_phrase(phrase)
-                                norm_found = self.enhanced_analyzer.morph.normalize_phrase(found_text)
+                                norm_found = morph.normalize_phrase(found_text)
                                 if norm_found != norm_phrase:
                                     valid_match = False
                                     break
@@ -356,7 +691,9 @@ class TextAnalyzer:
                         if valid_match:
                             matched.append(phrase)
                             for start_pos, end_pos in positions:
-                                result.highlights.append(
+                                # Вставка с сохранением порядка по start_pos, при равенстве — в порядке поиска
+                                insort(
+                                    result.highlights,
                                     ConversationHighlight(
                                         phrase=phrase,
                                         start_pos=start_pos,
@@ -366,7 +703,8 @@ class TextAnalyzer:
                                         dictionary_color=dictionary["color"],
                                         dictionary_type=dictionary["type"],
                                         match_type=match_type
-                                    )
+                                    ),
+                                    key=lambda highlight: highlight.start_pos
                                 )
 
                     # ДЛЯ АНАЛИЗА: contextual тоже считаем найденным, но не подсвечиваем
@@ -386,21 +724,50 @@ class TextAnalyzer:
             result.text_with_highlights = utterance.text
 
         # Сохраняем в кэш
-        self.analysis_cache[cache_key] = result
-        if len(self.analysis_cache) > 1000:
-            self.analysis_cache.clear()
+        self._store_result(cache_key, result)
 
         return result
 
     # Остальные методы остаются без изменений
     def analyze_conversation_batch(self, conversation: List[Dict | Utterance], dictionaries: List[Dict]) -> Dict[
         str, AnalysisResult]:
-        """Пакетный анализ разговора"""
+        """
+        Пакетный анализ разговора.
+        Высказывания, которых нет в кэше, при достаточном их количестве анализируются в пуле процессов.
+        """
         results = {}
-
-        for utterance_dict in conversation:
-            utterance = Utterance(**utterance_dict) if isinstance(utterance_dict, dict) else utterance_dict
-            results[f"{utterance.speaker}_{utterance.start_time}"] = self.analyze_utterance(utterance, dictionaries)
+        # Словари обрабатываются один раз на набор, а не внутри анализа каждого высказывания.
+        # Ключи кэша, пул и анализ берут версию из этого снимка, даже если другой поток сменит набор
+        state = self.ensure_preprocessed(dictionaries)
+
+        utterances = [Utterance(**utterance_dict) if isinstance(utterance_dict, dict) else utterance_dict
+                      for utterance_dict in conversation]
+
+        computed: Dict[Tuple[str, str, int], AnalysisResult] = {}
+        pending: Dict[Tuple[str, str, int], Utterance] = {}
+        with self._cache_lock:
+            for utterance in utterances:
+                cache_key = self._get_cache_key(utterance, state.version)
+                if cache_key not in self.analysis_cache:
+                    pending.setdefault(cache_key, utterance)
+
+        if self.max_workers > 1 and len(pending) >= PARALLEL_MIN_UTTERANCES:
+            pool = self._get_pool(state)
+            for cache_key, result in zip(pending, pool.map(_analyze_in_worker, pending.values(),
+                                                           chunksize=PARALLEL_CHUNK_SIZE)):
+                computed[cache_key] = result
+                self._store_result(cache_key, result)
+            with self._cache_lock:
+                self.cache_misses += len(computed)
+        elif pending:
+            # Слова разговора нормализуются один раз до анализа высказываний
+            self.enhanced_analyzer.morph.prime_words(utterance.text for utterance in pending.values())
+
+        for utterance in utterances:
+            result = computed.get(self._get_cache_key(utterance, state.version))
+            if result is None:
+                result = self._analyze_utterance(utterance, dictionaries, state)
+            results[f"{utterance.speaker}_{utterance.start_time}"] = result
 
         logger.info(
             f"Cache stats: hits={self.cache_hits}, misses={self.cache_misses}, ratio={self.cache_hits / (self.cache_hits + self.cache_misses) if self.cache_hits + self.cache_misses > 0 else 0:.2f}")
@@ -410,11 +777,13 @@ class TextAnalyzer:
     def get_conversation_with_highlights(self, conversation: List[Dict | Utterance], dictionaries: List[Dict],
                                          recording_id: int) -> List[ConversationModel]:
         """Быстрое получение разговора с подсветками"""
-        analyzed = self.analyze_conversation_batch(conversation, dictionaries)
+        # Словари превращаются в Utterance один раз и используются и для анализа, и для результата
+        utterances = [Utterance(**utterance_dict) if isinstance(utterance_dict, dict) else utterance_dict
+                      for utterance_dict in conversation]
+        analyzed = self.analyze_conversation_batch(utterances, dictionaries)
         result = []
 
-        for utterance_dict in conversation:
-            utterance = Utterance(**utterance_dict) if isinstance(utterance_dict, dict) else utterance_dict
+        for utterance in utterances:
             key = f"{utterance.speaker}_{utterance.start_time}"
             analysis = analyzed[key]
 
@@ -435,5 +804,23 @@ class TextAnalyzer:
 
     def clear_cache(self):
         """Очистка кэша"""
-        self.analysis_cache.clear()
-        self.enhanced_analyzer.morph.normalize_word.cache_clear()
\ No newline at end of file
+        with self._cache_lock:
+            self.analysis_cache.clear()
+        self.enhanced_analyzer.morph.normal_forms.clear()
+
+
+# Анализатор процесса пула: создается один раз при запуске процесса со словарями родителя
+_worker_analyzer: Optional[TextAnalyzer] = None
+
+
+def _init_worker(state: PreprocessedState) -> None:
+    """Инициализатор процесса пула: принимает предобработанные в родителе словари и автоматы"""
+    global _worker_analyzer
+    _worker_analyzer = TextAnalyzer(max_workers=1)
+    _worker_analyzer.load_preprocessed_state(state)
+
+
+def _analyze_in_worker(utterance: Utterance) -> AnalysisResult:
+    """Анализ одного высказывания в процессе пула"""
+    state = _worker_analyzer.get_preprocessed_state()
+    return _worker_analyzer._analyze_utterance(utterance, state.dictionaries, state)
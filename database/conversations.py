@@ -0,0 +1,58 @@
+# database/conversations.py
+from datetime import datetime
+from typing import List
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql.selectable import CTE
+from sqlmodel import Session, select, col
+
+from entities.conversation_entity import ConversationEntity
+
+# Реплики записи перезаписываются по (recording_id, utterance_idx); created остается от первой записи
+_CONVERSATION_UPSERT = insert(ConversationEntity)
+_CONVERSATION_UPSERT = _CONVERSATION_UPSERT.on_conflict_do_update(
+    index_elements=["recording_id", "utterance_idx"],
+    set_={
+        column.name: _CONVERSATION_UPSERT.excluded[column.name]
+        for column in ConversationEntity.__table__.columns
+        if column.name not in ("id", "recording_id", "utterance_idx", "created")
+    }
+)
+
+
+def save_conversation(session: Session, recording_id: int, utterances: List[dict]) -> CTE:
+    """
+    Записывает реплики одним многострочным INSERT ... ON CONFLICT DO UPDATE: при повторной обработке
+    строки обновляются на месте, без предварительного DELETE. У всех словарей должен быть одинаковый набор ключей.
+    Возвращает CTE с удалением реплик, которых нет в новом разговоре (он стал короче): его присоединяют
+    к UPDATE статуса записи, чтобы не делать отдельный запрос
+    """
+    # created/updated заполняются здесь, так как в таблице у них нет значений по умолчанию
+    now = datetime.now()
+    rows = [
+        dict(utterance, recording_id=recording_id, utterance_idx=idx, created=now, updated=now)
+        for idx, utterance in enumerate(utterances)
+    ]
+    if rows:
+        session.execute(_CONVERSATION_UPSERT, rows)
+
+    return delete(ConversationEntity).where(
+        col(ConversationEntity.recording_id) == recording_id,
+        col(ConversationEntity.utterance_idx) >= len(rows)
+    ).cte("stale_conversations")
+
+
+def load_utterances(session: Session, recording_id: int) -> List[dict]:
+    """Реплики записи в порядке разговора: только поля Utterance"""
+    rows = session.exec(
+        select(
+            ConversationEntity.speaker,
+            ConversationEntity.text,
+            ConversationEntity.start_time,
+            ConversationEntity.end_time
+        )
+        .where(ConversationEntity.recording_id == recording_id)
+        .order_by(col(ConversationEntity.utterance_idx))
+    ).all()
+    return [row._asdict() for row in rows]
@@ -1,7 +1,11 @@
 import time
 
+import orjson
+
 from sqlmodel import create_engine, SQLModel, Session, text
 from psycopg2 import OperationalError
+from psycopg2.errors import LockNotAvailable
+from sqlalchemy.exc import DBAPIError
 from contextlib import contextmanager, AbstractContextManager
 from classes.logger import Logger
 
@@ -10,6 +14,14 @@ from database.migrations import MigrationManager
 
 MAX_RETRIES = 3
 RETRY_DELAY = 0.3
+# Сколько запрос API ждет блокировку строки, занятую фоновой обработкой, прежде чем отказать
+API_LOCK_TIMEOUT = "3s"
+
+
+def json_serializer(obj) -> str:
+    """Сериализация JSON-колонок через orjson; нестроковые ключи (id словарей) приводятся к строкам, как в json.dumps"""
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
 
 # IMPORT MODELS #
 
@@ -17,7 +29,11 @@ RETRY_DELAY = 0.3
 
 class DatabaseManager:
     def __init__(self):
-        self.engine = create_engine(str(settings.database_url))
+        self.engine = create_engine(
+            str(settings.database_url),
+            json_serializer=json_serializer,
+            json_deserializer=orjson.loads
+        )
 
         # Создаем таблицы только в dev/test режиме
         if MigrationManager.is_development():
@@ -57,3 +73,13 @@ class DatabaseManager:
 
 db_manager = DatabaseManager()
 write_session = db_manager.write_session
+
+
+def set_lock_timeout(session: Session, timeout: str = API_LOCK_TIMEOUT):
+    """Ограничивает ожидание блокировок до конца текущей транзакции (как SET LOCAL lock_timeout)"""
+    session.execute(text("SELECT set_config('lock_timeout', :timeout, true)"), {"timeout": timeout})
+
+
+def is_lock_timeout(error: DBAPIError) -> bool:
+    """Запрос прерван по lock_timeout: строку держит другая транзакция"""
+    return isinstance(error.orig, LockNotAvailable)
@@ -0,0 +1,55 @@
+"""Move recording conversation to conversations
+
+Revision ID: 7d2f9c4b1e53
+Revises: e3c8a1f5b629
+Create Date: 2026-10-14 17:12:44.905317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d2f9c4b1e53'
+down_revision: Union[str, Sequence[str], None] = 'e3c8a1f5b629'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Реплики из JSON переносятся строками; уже проанализированные строки остаются как есть
+    op.execute(
+        """
+        INSERT INTO conversations (recording_id, utterance_idx, speaker, text, start_time, end_time, created, updated)
+        SELECT r.id, u.idx - 1, u.item ->> 'speaker', u.item ->> 'text',
+               (u.item ->> 'start_time')::float, (u.item ->> 'end_time')::float, now(), now()
+        FROM recordings r
+        CROSS JOIN LATERAL json_array_elements(r.conversation) WITH ORDINALITY AS u(item, idx)
+        WHERE json_typeof(r.conversation) = 'array'
+        ON CONFLICT (recording_id, utterance_idx) DO NOTHING
+        """
+    )
+    op.drop_column('recordings', 'conversation')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column('recordings', sa.Column('conversation', sa.JSON(), nullable=True))
+    op.execute(
+        """
+        UPDATE recordings r
+        SET conversation = c.conversation
+        FROM (
+            SELECT recording_id,
+                   json_agg(json_build_object(
+                       'speaker', speaker, 'text', text, 'start_time', start_time, 'end_time', end_time
+                   ) ORDER BY utterance_idx) AS conversation
+            FROM conversations
+            GROUP BY recording_id
+        ) c
+        WHERE r.id = c.recording_id
+        """
+    )
@@ -0,0 +1,44 @@
+"""Add conversations utterance idx
+
+Revision ID: e3c8a1f5b629
+Revises: 9b4f2d6e8a17
+Create Date: 2026-10-14 15:41:07.218593
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3c8a1f5b629'
+down_revision: Union[str, Sequence[str], None] = '9b4f2d6e8a17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('conversations', sa.Column('utterance_idx', sa.Integer(), nullable=True))
+    # Нумеруем уже сохраненные реплики в порядке вставки, чтобы повторный анализ обновлял их на месте
+    op.execute(
+        """
+        UPDATE conversations c
+        SET utterance_idx = numbered.idx
+        FROM (
+            SELECT id, row_number() OVER (PARTITION BY recording_id ORDER BY id) - 1 AS idx
+            FROM conversations
+        ) numbered
+        WHERE c.id = numbered.id
+        """
+    )
+    op.create_unique_constraint(
+        'uq_conversations_recording_id_utterance_idx', 'conversations', ['recording_id', 'utterance_idx']
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_conversations_recording_id_utterance_idx', 'conversations', type_='unique')
+    op.drop_column('conversations', 'utterance_idx')
@@ -0,0 +1,98 @@
+# database/notifications.py
+import select
+import socket
+from typing import Optional
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT, connection as PgConnection
+from sqlmodel import Session, text
+
+from classes.logger import Logger
+from classes.settings import settings
+
+# Каналы LISTEN/NOTIFY: появились записи для распознавания / для анализа
+RECOGNIZE_CHANNEL = "recognize_tasks"
+ANALYSIS_CHANNEL = "analysis_tasks"
+
+
+def notify(session: Session, channel: str):
+    """Отправляет уведомление на канал; Postgres доставит его слушателям при коммите транзакции"""
+    session.execute(text("SELECT pg_notify(:channel, '')"), {"channel": channel})
+
+
+class NotificationListener:
+    """
+    Ожидание уведомлений Postgres (LISTEN) на отдельном соединении вне пула SQLAlchemy.
+    Позволяет потокам-наблюдателям забирать задачи сразу после NOTIFY, а не по таймеру.
+    Если соединение недоступно, wait() просто выжидает timeout — вызывающий код продолжает опрос БД.
+    """
+
+    def __init__(self, *channels: str):
+        self.channels = channels
+        self.connection: Optional[PgConnection] = None
+        # Пара сокетов будит wait() из stop(); select на Windows работает только с сокетами
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self.stopped = False
+
+    def _connect(self):
+        try:
+            self.connection = psycopg2.connect(str(settings.database_url))
+            self.connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with self.connection.cursor() as cursor:
+                for channel in self.channels:
+                    cursor.execute(f"LISTEN {channel}")
+        except psycopg2.Error as e:
+            Logger.warn(f"Notification listener could not connect: {e}")
+            self._disconnect()
+
+    def _disconnect(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except psycopg2.Error:
+                pass
+            self.connection = None
+
+    def wait(self, timeout: float) -> bool:
+        """Ждет уведомление не дольше timeout секунд; True, если уведомление пришло"""
+        if self.stopped:
+            return False
+        if self.connection is None:
+            self._connect()
+
+        readers = [self._wakeup_reader]
+        if self.connection is not None:
+            readers.append(self.connection)
+        try:
+            ready, _, _ = select.select(readers, [], [], timeout)
+            if self._wakeup_reader in ready:
+                # Сигнал из wake()/stop(): вычитываем его, чтобы следующее ожидание не завершилось сразу
+                self._wakeup_reader.recv(1024)
+                return False
+            if self.connection is not None and self.connection in ready:
+                self.connection.poll()
+                notified = bool(self.connection.notifies)
+                self.connection.notifies.clear()
+                return notified
+        except (psycopg2.Error, OSError) as e:
+            Logger.warn(f"Notification listener error: {e}")
+            self._disconnect()
+        return False
+
+    def wake(self):
+        """Прерывает текущее ожидание, как будто истек timeout; можно вызывать из другого потока"""
+        try:
+            self._wakeup_writer.send(b"\0")
+        except OSError:
+            pass
+
+    def stop(self):
+        """Прерывает текущее и все последующие ожидания; можно вызывать из другого потока"""
+        self.stopped = True
+        self.wake()
+
+    def close(self):
+        """Закрывает соединение; вызывается потоком, который ждал уведомления"""
+        self._disconnect()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
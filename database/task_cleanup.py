@@ -13,6 +13,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 # database/task_cleanup.py
+from sqlalchemy import case, or_
 from sqlmodel import update,col
 
 from classes.logger import Logger
@@ -25,25 +26,28 @@ class TaskCleanup:
     @staticmethod
     def reset_stuck_tasks():
         """Сбрасывает зависшие задачи при запуске приложения"""
-        with write_session() as session:
-            # Сбрасываем зависшие задачи распознавания
-            session.exec(
-                update(RecordingEntity)
-                .where(col(RecordingEntity.recognize_status).in_([
-                    RecordingTaskStatus.PENDING.value,
-                    RecordingTaskStatus.FAILED.value
-                ]))
-                .values(recognize_status=RecordingTaskStatus.NEW.value)
-            )
+        stuck_statuses = [
+            RecordingTaskStatus.PENDING,
+            RecordingTaskStatus.FAILED
+        ]
+        recognize_stuck = col(RecordingEntity.recognize_status).in_(stuck_statuses)
+        analysis_stuck = col(RecordingEntity.analysis_status).in_(stuck_statuses)
 
-            # Сбрасываем зависшие задачи анализа
+        with write_session() as session:
+            # Сбрасываем зависшие задачи распознавания и анализа одним запросом
             session.exec(
                 update(RecordingEntity)
-                .where(col(RecordingEntity.analysis_status).in_([
-                    RecordingTaskStatus.PENDING.value,
-                    RecordingTaskStatus.FAILED.value
-                ]))
-                .values(analysis_status=RecordingTaskStatus.NEW.value)
+                .where(or_(recognize_stuck, analysis_stuck))
+                .values(
+                    recognize_status=case(
+                        (recognize_stuck, RecordingTaskStatus.NEW),
+                        else_=col(RecordingEntity.recognize_status)
+                    ),
+                    analysis_status=case(
+                        (analysis_stuck, RecordingTaskStatus.NEW),
+                        else_=col(RecordingEntity.analysis_status)
+                    )
+                )
             )
 
             session.commit()
@@ -3,6 +3,9 @@ from classes.settings import settings
 
 from middleware.ip_whitelist import IPWhitelistMiddleware
 
+# Проверки IP не зависят от запроса, поэтому один экземпляр используется всеми эндпоинтами
+_middleware = IPWhitelistMiddleware(app=None)
+
 
 def ip_whitelist_dependency():
     """Dependency для проверки IP в отдельных эндпоинтах"""
@@ -11,10 +14,9 @@ def ip_whitelist_dependency():
         if not settings.ENABLE_IP_WHITELIST:
             return request.client.host
 
-        middleware = IPWhitelistMiddleware(app=None)
-        client_ip = middleware.get_real_ip(request)
+        client_ip = _middleware.get_real_ip(request)
 
-        if not middleware.is_ip_allowed(client_ip):
+        if not _middleware.is_ip_allowed(client_ip):
             raise HTTPException(
                 status_code=403,
                 detail=f"Access denied for IP: {client_ip}"
@@ -1,6 +1,6 @@
 from typing import Optional
 
-from sqlmodel import Field, JSON
+from sqlmodel import Field, JSON, Index, UniqueConstraint
 
 from entities.mixins.created_updated import TimeStampMixin
 from entities.mixins.id_column import IdColumnMixin
@@ -11,6 +11,11 @@ class ConversationBase:
     recording_id: Optional[int] = Field(
         index=True
     )
+    # Порядковый номер реплики в разговоре записи: ключ перезаписи при повторном анализе
+    utterance_idx: Optional[int] = Field(
+        nullable=True,
+        default=None
+    )
     speaker:str = Field(
         nullable=True,
         index=True
@@ -35,3 +40,8 @@ class ConversationBase:
 
 class ConversationEntity(TimeStampMixin, ConversationBase,IdColumnMixin, table=True):
     __tablename__ = "conversations"
+    __table_args__ = (
+        # Реплики записи выбираются по recording_id и отдаются в порядке id — без отдельной сортировки
+        Index("ix_conversations_recording_id_id", "recording_id", "id"),
+        UniqueConstraint("recording_id", "utterance_idx", name="uq_conversations_recording_id_utterance_idx"),
+    )
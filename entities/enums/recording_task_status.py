@@ -1,7 +1,7 @@
-from enum import Enum
+from enum import IntEnum
 
 
-class RecordingTaskStatus(Enum):
+class RecordingTaskStatus(IntEnum):
     NEW = 0
     PENDING = 1
     FINISHED = 2
@@ -5,9 +5,6 @@ from sqlmodel import Field
 from entities.enums.recording_task_status import RecordingTaskStatus
 from entities.mixins.created_updated import TimeStampMixin
 from entities.mixins.id_column import IdColumnMixin
-from sqlalchemy import JSON
-
-from models.recognizer_models import Utterance
 
 
 class RecordingEntityBase:
@@ -15,23 +12,18 @@ class RecordingEntityBase:
         nullable=False,
         index=True,
         unique=True,
-    ),
+    )
     recognize_status: int = Field(
-        default=RecordingTaskStatus.NEW.value,
+        default=RecordingTaskStatus.NEW,
         index=True
     )
     analysis_status: int = Field(
-        default=RecordingTaskStatus.NEW.value,
+        default=RecordingTaskStatus.NEW,
         index=True
     )
     duration: float = Field(
         nullable=True
     )
-    conversation: list[Utterance] = Field(
-        sa_type=JSON,
-        default=None,
-        nullable=True
-    )
 
     recognize_start: datetime | None = Field(nullable=True)
     recognize_end: datetime | None = Field(nullable=True)
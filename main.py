@@ -1,72 +1,20 @@
-from contextlib import asynccontextmanager
-
 import uvicorn
-from fastapi import FastAPI, Depends
-
-from classes.logger import Logger
-from database.migrations import MigrationManager
-from database.task_cleanup import TaskCleanup
-from middleware.ip_whitelist import IPWhitelistMiddleware
-from routes.conversation import conversations
-from routes.dictionaries import dictionaries
-from routes.recordings import recordings
-from routes.tags import tags
 
-from database.database import db_manager
 from classes.settings import settings
-from threads.analyze_text_thread import TaskProcessor
-from threads.recognize_record_thread import recognize_thread
-
-
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Сбрасываем зависшие задачи
-    TaskCleanup.reset_stuck_tasks()
-    # Только если используем Nuitka (проверка скомпилированного режима)
-    MigrationManager.run_migrations()
-    Logger.info('Generator lifespan at start of app')
-    recognize_thread.start()
-
-    # Инициализация обработчика задач
-    analyze_text_processor = TaskProcessor(max_workers=4)
-    analyze_text_processor.start_fetcher(interval=30)
-
-    yield
-    # Останавливаем потоки при завершении
-    recognize_thread.stop()
-    analyze_text_processor.shutdown()
-    # Clean up the ML entities and release the resources
-    Logger.info('Finish lifespan at end of app')
-
-
-app = FastAPI(
-    lifespan=lifespan,
-    root_path=settings.API_ROOT,
-    docs_url="/docs" if settings.APP_MODE != "production" else None,
-    redoc_url="/redoc" if settings.APP_MODE != "production" else None,
-    openapi_url="/openapi.json" if settings.APP_MODE != "production" else None
-)
-
-# Добавляем middleware если включена IP-фильтрация
-if settings.ENABLE_IP_WHITELIST:
-    app.add_middleware(IPWhitelistMiddleware)
-    print(f"IP whitelist enabled. Allowed IPs: {settings.ALLOWED_IPS}")
-else:
-    print("IP whitelist is disabled")
-
-
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy", "service": "whisper-api"}
-
-
-app.include_router(recordings)
-app.include_router(dictionaries)
-
-app.include_router(conversations)
-app.include_router(tags)
 
-# your app code here
+# Приложение собирается в application.py, здесь только запуск uvicorn. Процессы пула анализа
+# (forkserver) повторно выполняют главный модуль как __mp_main__: из main.py они не создают
+# приложение, движок БД и фоновые потоки
 
 if __name__ == "__main__":
-    uvicorn.run(app, port=8000)
+    # Все процессы uvicorn получают одно окружение: с ролью планировщика каждый загрузил бы
+    # свою модель Whisper и свой пул анализа. Планировщик запускается отдельным процессом
+    if settings.api_workers > 1 and settings.scheduler_role:
+        raise SystemExit(
+            f"SCHEDULER_ROLE=1 несовместим с несколькими процессами API "
+            f"(API_WORKERS={settings.API_WORKERS}, процессов: {settings.api_workers}): "
+            "запустите процессы API с SCHEDULER_ROLE=0, а планировщик — отдельно с одним процессом"
+        )
+    # Несколько процессов требуют строку импорта приложения; uvloop и httptools
+    # подключаются автоматически, если установлены
+    uvicorn.run("application:app", port=8000, workers=settings.api_workers)
@@ -1,43 +1,139 @@
 # middleware/ip_whitelist.py
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
 from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
 import ipaddress
 from classes.settings import settings
 
+# Заголовки прокси в порядке проверки; в ASGI имена заголовков приходят в нижнем регистре
+PROXY_HEADERS = (b"x-real-ip", b"x-forwarded-for")
+
+# Самый длинный текстовый IPv6-адрес (без зоны) — 39 символов
+MAX_IP_LENGTH = 39
+
+
+@lru_cache(maxsize=1024)
+def _fast_parse(ip: Optional[str]) -> Optional[ipaddress.IPv4Address | ipaddress.IPv6Address]:
+    """
+    Разбирает IP-адрес, сразу отбрасывая заведомо невалидные строки.
+    В отличие от ipaddress.ip_address не пробует IPv4, а затем IPv6: версия определяется по разделителю.
+    Возвращает None, если строка не является IP-адресом.
+    """
+    if not ip or len(ip) > MAX_IP_LENGTH:
+        return None
+    try:
+        if ":" in ip:
+            return ipaddress.IPv6Address(ip)
+        if "." in ip:
+            return ipaddress.IPv4Address(ip)
+    except ValueError:
+        pass
+    return None
+
+
+class NetworkSet:
+    """
+    Список IP-адресов и сетей из настроек, сведенный в отсортированные непересекающиеся
+    интервалы целых чисел отдельно для IPv4 и IPv6: проверка адреса — один bisect.
+    Строки, которые не разобрались как IP (hostname вроде localhost), хранятся отдельно.
+    """
+
+    def __init__(self, entries: List):
+        self.configured = bool(entries)
+        self.names = {entry for entry in entries if isinstance(entry, str)}
+        ranges: Dict[int, List[Tuple[int, int]]] = {4: [], 6: []}
+        for entry in entries:
+            if isinstance(entry, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+                ranges[entry.version].append((int(entry.network_address), int(entry.broadcast_address)))
+            elif isinstance(entry, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+                ranges[entry.version].append((int(entry), int(entry)))
 
-class IPWhitelistMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
+        self.starts: Dict[int, List[int]] = {}
+        self.ends: Dict[int, List[int]] = {}
+        for version, version_ranges in ranges.items():
+            starts, ends = [], []
+            for start, end in sorted(version_ranges):
+                # Пересекающиеся и смежные интервалы объединяются
+                if ends and start <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self.starts[version] = starts
+            self.ends[version] = ends
+
+    def contains(self, ip_obj: ipaddress.IPv4Address | ipaddress.IPv6Address) -> bool:
+        """Адрес входит в одну из сетей или совпадает с одним из адресов списка"""
+        ip_int = int(ip_obj)
+        index = bisect_right(self.starts[ip_obj.version], ip_int) - 1
+        return index >= 0 and ip_int <= self.ends[ip_obj.version][index]
+
+
+class IPWhitelistMiddleware:
+    """
+    ASGI middleware проверки IP клиента.
+    Работает прямо со scope, без BaseHTTPMiddleware: не создает Request, задач и обертки ответа на каждый запрос.
+    """
+
+    def __init__(self, app: Optional[ASGIApp]):
+        self.app = app
+        # Списки из настроек разбираются один раз, а не на каждый запрос
+        self.allowed_networks = NetworkSet(settings.allowed_networks)
+        self.trusted_proxies = NetworkSet(settings.trusted_proxies_list)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         # Если IP-фильтрация отключена, пропускаем проверку
-        if not settings.ENABLE_IP_WHITELIST:
-            return await call_next(request)
+        if scope["type"] != "http" or not settings.ENABLE_IP_WHITELIST:
+            await self.app(scope, receive, send)
+            return
 
         # Получаем реальный IP клиента
-        client_ip = self.get_real_ip(request)
+        client = scope.get("client")
+        client_ip = self.resolve_ip(client[0] if client else None, scope["headers"])
 
         # Проверяем доступ
         if not self.is_ip_allowed(client_ip):
-            return JSONResponse(
+            response = JSONResponse(
                 status_code=403,
                 content={
                     "detail": f"Access denied for IP: {client_ip}",
                     "allowed_ips": settings.ALLOWED_IPS
                 }
             )
+            await response(scope, receive, send)
+            return
 
-        # Добавляем IP в запрос для дальнейшего использования
-        request.state.client_ip = client_ip
-        return await call_next(request)
+        # Добавляем IP в запрос для дальнейшего использования (request.state.client_ip)
+        scope.setdefault("state", {})["client_ip"] = client_ip
+        await self.app(scope, receive, send)
 
     def get_real_ip(self, request: Request) -> str:
         """Получает реальный IP клиента с учетом прокси"""
-        client_ip = request.client.host
+        return self.resolve_ip(request.client.host if request.client else None, request.scope["headers"])
+
+    def resolve_ip(self, client_host: Optional[str], headers: Iterable[Tuple[bytes, bytes]]) -> str:
+        """Определяет IP клиента по адресу соединения и сырым заголовкам ASGI с учетом прокси"""
+        client_ip = client_host
 
         # Если есть доверенные прокси, проверяем заголовки
-        if settings.trusted_proxies_list:
-            for header in ["X-Real-IP", "X-Forwarded-For"]:
-                if header in request.headers:
-                    ips = [ip.strip() for ip in request.headers[header].split(",")]
+        if self.trusted_proxies.configured:
+            # Первое значение каждого заголовка прокси, как в request.headers[...]
+            # Заголовки просматриваются один раз и только до тех пор, пока не найдены оба;
+            # значения декодируются лишь при использовании
+            header_values = {}
+            for name, value in headers:
+                if name in PROXY_HEADERS and name not in header_values:
+                    header_values[name] = value
+                    if len(header_values) == len(PROXY_HEADERS):
+                        break
+
+            for header in PROXY_HEADERS:
+                if header in header_values:
+                    ips = [ip.strip() for ip in header_values[header].decode("latin-1").split(",")]
                     # Ищем первый непроксированный IP
                     for ip in reversed(ips):
                         if ip and not self.is_trusted_proxy(ip):
@@ -48,29 +144,13 @@ class IPWhitelistMiddleware(BaseHTTPMiddleware):
 
     def is_trusted_proxy(self, ip: str) -> bool:
         """Проверяет, является ли IP доверенным прокси"""
-        try:
-            ip_obj = ipaddress.ip_address(ip)
-            for proxy in settings.trusted_proxies_list:
-                if (isinstance(proxy, (ipaddress.IPv4Network, ipaddress.IPv6Network)) and ip_obj in proxy) or \
-                        (isinstance(proxy, (ipaddress.IPv4Address, ipaddress.IPv6Address)) and ip_obj == proxy) or \
-                        (isinstance(proxy, str) and proxy == ip):
-                    return True
-        except ValueError:
-            pass
-        return False
+        ip_obj = _fast_parse(ip)
+        return ip_obj is not None and self.trusted_proxies.contains(ip_obj)
 
     def is_ip_allowed(self, ip: str) -> bool:
         """Проверяет, разрешен ли IP"""
-        try:
-            ip_obj = ipaddress.ip_address(ip)
-            for net in settings.allowed_networks:
-                if (isinstance(net, (ipaddress.IPv4Network, ipaddress.IPv6Network)) and ip_obj in net) or \
-                        (isinstance(net, (ipaddress.IPv4Address, ipaddress.IPv6Address)) and ip_obj == net) or \
-                        (isinstance(net, str) and net == ip):
-                    return True
-        except ValueError:
-            # Если IP невалидный, проверяем как строку (для hostnames)
-            for net in settings.allowed_networks:
-                if isinstance(net, str) and net == ip:
-                    return True
-        return False
+        # Строковые записи (hostnames) сравниваются как есть
+        if ip in self.allowed_networks.names:
+            return True
+        ip_obj = _fast_parse(ip)
+        return ip_obj is not None and self.allowed_networks.contains(ip_obj)
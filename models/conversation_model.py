@@ -1,7 +1,7 @@
 from enum import StrEnum
 from typing import Dict, Optional, List
 
-from pydantic import Field, BaseModel
+from pydantic import ConfigDict, Field, BaseModel
 
 
 class ConversationMatchType(StrEnum):
@@ -11,6 +11,9 @@ class ConversationMatchType(StrEnum):
 
 
 class ConversationHighlight(BaseModel):
+    # Подсветки только создаются и сериализуются: неизменяемые и хешируемые
+    model_config = ConfigDict(frozen=True)
+
     phrase: str
     start_pos: int
     end_pos: int
@@ -1,9 +1,10 @@
 from datetime import datetime
 from typing import Any, Union
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 class SuccessResponse(BaseModel):
     success: bool = True
     data: Union[None,Any] = None
-    timestamp: datetime = datetime.now()
\ No newline at end of file
+    # Время формирования ответа, а не импорта модуля
+    timestamp: datetime = Field(default_factory=datetime.now)
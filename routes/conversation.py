@@ -1,7 +1,10 @@
 from fastapi import APIRouter
-from sqlmodel import select, asc
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import select, asc, update, text, func
 
-from database.database import write_session
+from database.database import is_lock_timeout, set_lock_timeout, write_session
+from database.notifications import ANALYSIS_CHANNEL, notify
 from entities.conversation_entity import ConversationEntity
 from entities.enums.recording_task_status import RecordingTaskStatus
 from entities.recording_entity import RecordingEntity
@@ -13,16 +16,46 @@ conversations = APIRouter(
     tags=['conversations']
 )
 
+# Первая подсветка каждого словаря в порядке реплик и подсветок внутри реплики.
+# Реплики без подсветок дают строку с NULL: так запись без разговора отличается от разговора без совпадений
+_RECORDING_DICTIONARIES_SQL = text("""
+    SELECT highlight FROM (
+        SELECT DISTINCT ON (h.value ->> 'dictionary_id')
+            h.value AS highlight, c.id AS conversation_id, h.idx
+        FROM conversations c
+        LEFT JOIN LATERAL json_array_elements(c.analysis -> 'highlights')
+            WITH ORDINALITY AS h(value, idx) ON true
+        WHERE c.recording_id = :record_id
+            -- Реплики, сохраненные распознаванием, но еще не проанализированные, не учитываются
+            AND json_typeof(c.analysis) = 'object'
+        ORDER BY h.value ->> 'dictionary_id', c.id, h.idx
+    ) first_highlights
+    ORDER BY conversation_id, idx
+""")
+
 
 @conversations.put('/{record_id}', response_model=SuccessResponse)
 def analyze_conversation_force(
         record_id: int
 ):
     with write_session() as sess:
-        recording = sess.get(RecordingEntity, record_id)
-        if recording:
-            recording.analysis_status = RecordingTaskStatus.NEW.value
-            sess.add(recording)
+        # Запись может держать транзакция фоновой обработки: ждем недолго и отвечаем отказом
+        set_lock_timeout(sess)
+        try:
+            # Статус меняется одним UPDATE, без загрузки записи
+            result = sess.exec(
+                update(RecordingEntity)
+                .where(RecordingEntity.id == record_id)
+                .values(analysis_status=RecordingTaskStatus.NEW)
+                .execution_options(synchronize_session=False)
+            )
+        except DBAPIError as e:
+            if not is_lock_timeout(e):
+                raise
+            sess.rollback()
+            return SuccessResponse(success=False)
+        if result.rowcount:
+            notify(sess, ANALYSIS_CHANNEL)
             return SuccessResponse()
 
     return SuccessResponse(
@@ -34,19 +67,21 @@ def get_recording(
         record_id: int
 ):
     with write_session() as sess:
-        conversations_orm: list[ConversationEntity] = sess.exec(
-            select(ConversationEntity)
+        # Только поля ConversationIdModel: строки отдаются как есть, без ORM-объектов и повторной валидации
+        conversations_rows = sess.exec(
+            select(*(getattr(ConversationEntity, field) for field in ConversationIdModel.model_fields))
             .where(ConversationEntity.recording_id == record_id)
+            # Как и в /dictionaries: строки распознавания без анализа не отдаются, пока анализ не выполнен
+            .where(func.json_typeof(ConversationEntity.analysis) == 'object')
             .order_by(asc(ConversationEntity.id))
-            .order_by(asc(ConversationEntity.start_time))
         ).all()
-        if not conversations_orm:
+        if not conversations_rows:
             return SuccessResponse(success=False)
         else:
-            return SuccessResponse(
-                data=[
-                    ConversationIdModel.model_validate(c.model_dump()) for c in conversations_orm
-                ]
+            return ORJSONResponse(
+                SuccessResponse(
+                    data=[row._asdict() for row in conversations_rows]
+                ).model_dump()
             )
 
 
@@ -55,24 +90,12 @@ def get_recording(
         record_id: int
 ):
     with write_session() as sess:
-        conversations_orm: list[ConversationEntity] = sess.exec(
-            select(ConversationEntity)
-            .where(ConversationEntity.recording_id == record_id)
-            .order_by(asc(ConversationEntity.id))
-            .order_by(asc(ConversationEntity.start_time))
-        ).all()
-        conversation_dictionaries: list[ConversationHighlight] = []
-        if not conversations_orm:
+        rows = sess.execute(_RECORDING_DICTIONARIES_SQL, {"record_id": record_id}).all()
+        if not rows:
             return SuccessResponse(success=False)
         else:
-            _all = [ConversationIdModel.model_validate(c.model_dump()) for c in conversations_orm]
-            for conversation in _all:
-                if len(conversation.analysis.highlights) > 0:
-                    for h in conversation.analysis.highlights:
-                        founded = False
-                        for d in conversation_dictionaries:
-                            if d.dictionary_id == h.dictionary_id:
-                                founded = True
-                        if not founded:
-                           conversation_dictionaries.append(h)
-            return SuccessResponse(data=conversation_dictionaries)
\ No newline at end of file
+            return ORJSONResponse(
+                SuccessResponse(
+                    data=[row.highlight for row in rows if row.highlight is not None]
+                ).model_dump()
+            )
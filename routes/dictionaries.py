@@ -1,5 +1,6 @@
 # routes/dictionaries.py
 from fastapi import APIRouter, HTTPException
+from sqlalchemy import insert
 from sqlmodel import select, update, col, delete
 from typing import List
 
@@ -11,6 +12,9 @@ from models.success_response import SuccessResponse
 
 dictionaries = APIRouter(prefix="/dictionaries", tags=["dictionaries"])
 
+# INSERT ... RETURNING строится один раз; SQLAlchemy кэширует его компиляцию
+_DICT_INSERT = insert(DictionaryEntity).returning(DictionaryEntity, sort_by_parameter_order=True)
+
 def get_db():
     with write_session() as session:
         yield session
@@ -21,22 +25,19 @@ def create_dictionary(
 ):
     with write_session() as session:
         try:
-            db_dict = DictionaryEntity.model_validate(
-                dictionary.model_dump()
-            )
-            session.add(db_dict)
+            # Строка и сгенерированный id возвращаются одним запросом, без refresh
+            db_dict = session.scalars(_DICT_INSERT, [dictionary.model_dump()]).one()
             session.commit()
-            session.refresh(db_dict)
 
             # Update all analyzed models
             # session.exec(
             #     update(RecordingEntity)
             #     .where(col(RecordingEntity.analysis_status).in_([
-            #         RecordingTaskStatus.PENDING.value,
-            #         RecordingTaskStatus.FAILED.value,
-            #         RecordingTaskStatus.FINISHED.value,
+            #         RecordingTaskStatus.PENDING,
+            #         RecordingTaskStatus.FAILED,
+            #         RecordingTaskStatus.FINISHED,
             #     ]))
-            #     .values(analysis_status=RecordingTaskStatus.NEW.value)
+            #     .values(analysis_status=RecordingTaskStatus.NEW)
             # )
 
             return db_dict
@@ -53,24 +54,23 @@ def restore_all_dictionaries(
             session.exec(
                 delete(DictionaryEntity)
             )
-            ret = []
-            for dictionary in _dictionaries:
-                db_dict = DictionaryEntity.model_validate(
-                    dictionary.model_dump()
-                )
-                session.add(db_dict)
-                session.flush()
-                ret.append(db_dict)
-                # Update all analyzed models
-                # session.exec(
-                #     update(RecordingEntity)
-                #     .where(col(RecordingEntity.analysis_status).in_([
-                #         RecordingTaskStatus.PENDING.value,
-                #         RecordingTaskStatus.FAILED.value,
-                #         RecordingTaskStatus.FINISHED.value,
-                #     ]))
-                #     .values(analysis_status=RecordingTaskStatus.NEW.value)
-                # )
+            if not _dictionaries:
+                return []
+            # Один INSERT ... VALUES (...), (...) RETURNING вместо add + flush на каждый словарь
+            ret = session.scalars(
+                _DICT_INSERT,
+                [dictionary.model_dump() for dictionary in _dictionaries]
+            ).all()
+            # Update all analyzed models
+            # session.exec(
+            #     update(RecordingEntity)
+            #     .where(col(RecordingEntity.analysis_status).in_([
+            #         RecordingTaskStatus.PENDING,
+            #         RecordingTaskStatus.FAILED,
+            #         RecordingTaskStatus.FINISHED,
+            #     ]))
+            #     .values(analysis_status=RecordingTaskStatus.NEW)
+            # )
 
             return ret
         except Exception as e:
@@ -119,11 +119,11 @@ def update_dictionary(dict_id: int, dictionary: DictionaryUpdate):
             # session.exec(
             #     update(RecordingEntity)
             #     .where(col(RecordingEntity.analysis_status).in_([
-            #         RecordingTaskStatus.PENDING.value,
-            #         RecordingTaskStatus.FAILED.value,
-            #         RecordingTaskStatus.FINISHED.value,
+            #         RecordingTaskStatus.PENDING,
+            #         RecordingTaskStatus.FAILED,
+            #         RecordingTaskStatus.FINISHED,
             #     ]))
-            #     .values(analysis_status=RecordingTaskStatus.NEW.value)
+            #     .values(analysis_status=RecordingTaskStatus.NEW)
             # )
 
             return db_dict
@@ -145,11 +145,11 @@ def delete_dictionary(dict_id: int):
             # session.exec(
             #     update(RecordingEntity)
             #     .where(col(RecordingEntity.analysis_status).in_([
-            #         RecordingTaskStatus.PENDING.value,
-            #         RecordingTaskStatus.FAILED.value,
-            #         RecordingTaskStatus.FINISHED.value,
+            #         RecordingTaskStatus.PENDING,
+            #         RecordingTaskStatus.FAILED,
+            #         RecordingTaskStatus.FINISHED,
             #     ]))
-            #     .values(analysis_status=RecordingTaskStatus.NEW.value)
+            #     .values(analysis_status=RecordingTaskStatus.NEW)
             # )
 
             return SuccessResponse()
@@ -1,12 +1,17 @@
+from datetime import datetime
 from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import select
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DBAPIError
 
-from database.database import write_session
+from database.conversations import load_utterances
+from database.database import is_lock_timeout, set_lock_timeout, write_session
+from database.notifications import RECOGNIZE_CHANNEL, notify
 from entities.enums.recording_task_status import RecordingTaskStatus
 from entities.recording_entity import RecordingEntity
-from models.recording_models import RecordingPost
+from models.recording_models import RecordingGet, RecordingPost
 from models.success_response import SuccessResponse
 
 recordings = APIRouter(
@@ -24,39 +29,65 @@ def get_recording(
         if not record:
             return SuccessResponse(success=False)
         else:
-            return SuccessResponse(data=record)
+            # Реплики хранятся строками conversations и собираются в ответ в порядке разговора
+            conversation = load_utterances(sess, record_id)
+            return SuccessResponse(
+                data=RecordingGet.model_validate(dict(record.model_dump(), conversation=conversation or None))
+            )
 
 
 @recordings.post('')
 def add_recording(
         model: RecordingPost
 ):
+    now = datetime.now()
     with write_session() as sess:
-        existing: RecordingEntity|None = sess.exec(
-            select(RecordingEntity).where(RecordingEntity.path == model.path)
-        ).first()
-        if not existing:
-            record = RecordingEntity(
+        # Новая запись вставляется одним запросом; при существующем path вставка пропускается
+        record: RecordingEntity|None = sess.scalars(
+            insert(RecordingEntity)
+            .values(
                 path=model.path,
-                recognize_status=RecordingTaskStatus.NEW.value,
-                analysis_status = RecordingTaskStatus.NEW.value,
+                recognize_status=RecordingTaskStatus.NEW,
+                analysis_status=RecordingTaskStatus.NEW,
+                created=now,
+                updated=now,
             )
-            sess.add(record)
+            .on_conflict_do_nothing(index_elements=[RecordingEntity.path])
+            .returning(RecordingEntity)
+        ).first()
+        if record:
+            notify(sess, RECOGNIZE_CHANNEL)
             return SuccessResponse(
                 data=record,
             )
-        else:
-            if (
-                    existing.recognize_status == RecordingTaskStatus.FINISHED.value
-                    and existing.analysis_status == RecordingTaskStatus.FINISHED.value
-            ):
-                existing.recognize_status = RecordingTaskStatus.NEW.value
-                existing.analysis_status = RecordingTaskStatus.NEW.value
-                sess.add(existing)
-                return SuccessResponse(
-                    data=existing
+
+        # Полностью обработанная запись отправляется на повторную обработку.
+        # Запись может держать транзакция фоновой обработки: ждем недолго и отвечаем отказом
+        set_lock_timeout(sess)
+        try:
+            existing: RecordingEntity|None = sess.scalars(
+                update(RecordingEntity)
+                .where(
+                    RecordingEntity.path == model.path,
+                    RecordingEntity.recognize_status == RecordingTaskStatus.FINISHED,
+                    RecordingEntity.analysis_status == RecordingTaskStatus.FINISHED,
                 )
+                .values(
+                    recognize_status=RecordingTaskStatus.NEW,
+                    analysis_status=RecordingTaskStatus.NEW,
+                )
+                .returning(RecordingEntity)
+            ).first()
+        except DBAPIError as e:
+            if not is_lock_timeout(e):
+                raise
+            sess.rollback()
+            return SuccessResponse(success=False)
+        if existing:
+            notify(sess, RECOGNIZE_CHANNEL)
+            return SuccessResponse(
+                data=existing
+            )
         return SuccessResponse(
             success=False
         )
-
@@ -1,173 +1,250 @@
 # services/task_processor.py
 import json
-from threading import Thread, Lock
-from queue import Queue
-from typing import Optional, List
+from concurrent.futures import Future, wait
+from threading import Event, Semaphore, Thread, Lock
+from typing import List, Set
 from datetime import datetime
 
-from sqlalchemy import delete
-from sqlmodel import select, col
+from sqlalchemy import update
+from sqlmodel import Session, select, col, text
 
 from classes.logger import Logger
+from database.conversations import load_utterances, save_conversation
 from database.database import write_session
-from entities.conversation_entity import ConversationEntity
+from database.notifications import ANALYSIS_CHANNEL, NotificationListener
 from models.recognizer_models import Utterance
 from entities.dictionary_entity import DictionaryEntity
 from entities.recording_entity import RecordingEntity
 from entities.enums.recording_task_status import RecordingTaskStatus
 from classes.text_analyzer import TextAnalyzer
+from threads.executor import ANALYSIS_PRIORITY, app_executor
 
+# Хеш содержимого таблицы словарей: меняется при любом добавлении, изменении или удалении
+_DICTIONARIES_VERSION_SQL = text("SELECT md5(string_agg(d::text, ',' ORDER BY d.id)) FROM dictionaries d")
 
 class TaskProcessor:
     def __init__(self, max_workers: int = 4):
         self.max_workers = max_workers
-        self.task_queue = Queue()
-        self.workers = []
+        # Пул общий с распознаванием: в его очереди и в обработке не больше max_workers задач анализа,
+        # при заполнении add_task ждет
+        self.slots = Semaphore(max_workers)
+        # Задачи, отправленные в общий пул: при остановке дожидаемся только своих
+        self.futures: Set[Future] = set()
         self.lock = Lock()
+        # id записей, уже стоящих в очереди или в обработке: повторно не выбираются и не ставятся
+        self.pending_ids = set()
+        # Последний снимок словарей и хеш таблицы, по которому он получен
+        self.dict_cache = {"version": None, "data": None}
         self.analyzer = TextAnalyzer()
-        self.is_running = True
-
-        for i in range(max_workers):
-            worker = Thread(target=self._worker, daemon=True, name=f"Worker-{i}")
-            worker.start()
-            self.workers.append(worker)
-
-    def _worker(self):
-        while self.is_running:
-            try:
-                task = self.task_queue.get()
-                if task is None:
-                    break
-
-                self._process_task(task)
-                self.task_queue.task_done()
-            except Exception as e:
-                Logger.err(f"Error in worker: {e}")
+        self.shutdown_event = Event()
+        self.listener = NotificationListener(ANALYSIS_CHANNEL)
+
+    def _run_task(self, recording_id: int):
+        try:
+            # Задача, дождавшаяся потока пула уже после остановки, не начинается
+            if not self.shutdown_event.is_set():
+                self._process_task(recording_id)
+        except Exception as e:
+            Logger.err(f"Error in worker: {e}")
+        finally:
+            with self.lock:
+                self.pending_ids.discard(recording_id)
+            self.slots.release()
 
     def _process_task(self, recording_id: int):
         with write_session() as session:
-            recording: Optional[RecordingEntity] = None
+            claimed = False
 
             try:
-                recording = session.get(RecordingEntity, recording_id)
-                if not recording:
-                    Logger.err(f"Recording {recording_id} not found")
+                # Захватываем задачу одним UPDATE ... RETURNING: запись переводится в PENDING,
+                # только если она все еще NEW, поэтому два воркера не возьмут ее одновременно.
+                # Захват фиксируется сразу: иначе блокировка строки держалась бы весь анализ
+                # и UPDATE из API (PUT /conversations, повторный POST /recordings) ждали бы его
+                claimed = session.scalar(
+                    update(RecordingEntity)
+                    .where(
+                        RecordingEntity.id == recording_id,
+                        RecordingEntity.analysis_status == RecordingTaskStatus.NEW
+                    )
+                    .values(
+                        analysis_status=RecordingTaskStatus.PENDING,
+                        analysis_start=datetime.now()
+                    )
+                    .returning(RecordingEntity.id)
+                ) is not None
+                if not claimed:
+                    Logger.warn(f"Recording {recording_id} not found or not NEW, skipping")
                     return
+                session.commit()
 
-                if recording.analysis_status != RecordingTaskStatus.NEW.value:
-                    Logger.warn(f"Recording {recording_id} has status {recording.analysis_status}, skipping")
-                    return
+                # Получаем словари из БД (из кэша, если таблица не менялась)
+                dict_data = self.get_dictionaries(session)
 
-                # Обновляем статус
-                recording.analysis_status = RecordingTaskStatus.PENDING.value
-                recording.analysis_start = datetime.now()
-                session.add(recording)
+                # Реплики, сохраненные распознаванием, читаются одним упорядоченным SELECT.
+                # model_validate проверяет словарь целиком в pydantic-core, без вызова __init__
+                utterances: List[Utterance] = [
+                    Utterance.model_validate(item) for item in load_utterances(session, recording_id)
+                ]
+                # Читающая транзакция завершается до анализа: соединение не простаивает
+                # в открытой транзакции, пока высказывания обрабатывает пул процессов
                 session.commit()
-                session.refresh(recording)
-
-                # Получаем словари из БД
-                dictionaries: List[DictionaryEntity] = session.exec(select(DictionaryEntity)).all()
-                dict_data = [{
-                    "id": dict.id,
-                    "name": dict.name,
-                    "color": dict.color,
-                    "type": dict.type,
-                    "phrases": dict.phrases,
-                } for dict in dictionaries]
 
-                # Анализируем разговор
-                if recording.conversation:
-                    # Преобразуем conversation в список Utterance
-                    utterances: List[Utterance] = []
-                    for item in recording.conversation:
-                        utterance = Utterance(
-                            speaker=item["speaker"],
-                            text=item["text"],
-                            start_time=item["start_time"],
-                            end_time=item["end_time"]
-                        )
-                        utterances.append(utterance)
+                # Реплики и статус FINISHED фиксируются одной короткой транзакцией: FINISHED выставляется
+                # одним UPDATE в конце, вместе с удалением лишних реплик. Запись, снова поставленную
+                # в очередь во время анализа, статус не перезаписывает
+                finish = (
+                    update(RecordingEntity)
+                    .where(
+                        RecordingEntity.id == recording_id,
+                        RecordingEntity.analysis_status == RecordingTaskStatus.PENDING
+                    )
+                    .values(analysis_status=RecordingTaskStatus.FINISHED)
+                )
 
-                    analysis_results = self.analyzer.analyze_conversation_batch(utterances, dict_data)
+                # Анализируем разговор
+                if utterances:
 
-                    Logger.info(f"Analysis results for recording {recording_id}")
-                    for key, res in analysis_results.items():
-                        if res.matched_phrases:
-                            pass
-                            # print(res.model_dump_json(indent=2))
+                    # Анализ выполняется один раз: get_conversation_with_highlights сам вызывает
+                    # analyze_conversation_batch, а тот раздает высказывания пулу процессов анализатора
                     conversation_with_highlights = self.analyzer.get_conversation_with_highlights(
                         utterances,
                         dict_data,
-                        recording_id=recording.id
+                        recording_id=recording_id
                     )
-                    # Здесь можно сохранить результаты анализа в БД
-                    # Например, добавить поле analysis_results в RecordingEntity
-                    # recording.analysis_results = analysis_results.model_dump()
+                    Logger.info(f"Analysis results for recording {recording_id}")
 
-                    # TODO Clear all conversation results before
-                    session.exec(
-                        delete(ConversationEntity).where(col(ConversationEntity.recording_id) == recording.id)
+                    # Реплики дополняются подсветками на месте. Удаление лишних реплик идет
+                    # в CTE того же запроса, что и смена статуса: на один обмен с БД меньше
+                    stale_conversations = save_conversation(
+                        session,
+                        recording_id,
+                        [utterance_with_highlights.model_dump() for utterance_with_highlights in conversation_with_highlights]
                     )
-
-                    for utterance_with_highlights in conversation_with_highlights:
-                        conversation = ConversationEntity(**utterance_with_highlights.model_dump())
-                        session.add(conversation)
-                        # print(
-                        #     f'[{utterance_with_highlights.start_time}] speaker: {utterance_with_highlights.speaker}, text: {utterance_with_highlights.text_with_highlights}')
+                    finish = finish.add_cte(stale_conversations)
 
                 # Обновляем статус после завершения
-                recording.analysis_status = RecordingTaskStatus.FINISHED.value
-                recording.analysis_end = datetime.now()
-                session.add(recording)
+                session.exec(
+                    finish.values(analysis_end=datetime.now()).execution_options(synchronize_session=False)
+                )
                 session.commit()
 
             except Exception as e:
                 Logger.err(f"Error processing recording {recording_id}: {e}")
-                # В случае ошибки помечаем запись как FAILED
-                if recording:
-                    recording.analysis_status = RecordingTaskStatus.FAILED.value
-                    recording.analysis_end = datetime.now()
-                    session.add(recording)
+                # Откатываем незавершенную транзакцию и помечаем запись как FAILED отдельной короткой
+                if claimed:
+                    session.rollback()
+                    session.exec(
+                        update(RecordingEntity)
+                        .where(
+                            RecordingEntity.id == recording_id,
+                            RecordingEntity.analysis_status == RecordingTaskStatus.PENDING
+                        )
+                        .values(
+                            analysis_status=RecordingTaskStatus.FAILED,
+                            analysis_end=datetime.now()
+                        )
+                        .execution_options(synchronize_session=False)
+                    )
                     session.commit()
 
+    def get_dictionaries(self, session: Session) -> List[dict]:
+        """
+        Словари для анализа. Таблица словарей меняется редко, поэтому сначала запрашивается
+        только ее хеш; словари перечитываются, лишь когда он изменился. Тот же список
+        передается анализатору, и тот переиспользует подготовленные автоматы без сверки фраз.
+        """
+        version = session.execute(_DICTIONARIES_VERSION_SQL).scalar()
+        with self.lock:
+            if self.dict_cache["data"] is not None and self.dict_cache["version"] == version:
+                return self.dict_cache["data"]
+
+        dictionaries: List[DictionaryEntity] = session.exec(select(DictionaryEntity)).all()
+        dict_data = [{
+            "id": dict.id,
+            "name": dict.name,
+            "color": dict.color,
+            "type": dict.type,
+            "phrases": dict.phrases,
+        } for dict in dictionaries]
+        with self.lock:
+            self.dict_cache = {"version": version, "data": dict_data}
+        return dict_data
+
     def add_task(self, recording_id: int):
-        self.task_queue.put(recording_id)
+        with self.lock:
+            if recording_id in self.pending_ids:
+                return
+            self.pending_ids.add(recording_id)
+
+        # Ждем свободного места; shutdown() освобождает слот, чтобы ожидание сразу прервалось
+        self.slots.acquire()
+        if self.shutdown_event.is_set():
+            self.slots.release()
+            with self.lock:
+                self.pending_ids.discard(recording_id)
+            return
+
+        try:
+            future = app_executor.submit(ANALYSIS_PRIORITY, self._run_task, recording_id)
+            self.futures.add(future)
+            future.add_done_callback(self.futures.discard)
+        except RuntimeError:
+            # Пул уже остановлен
+            self.slots.release()
+            with self.lock:
+                self.pending_ids.discard(recording_id)
 
     def fetch_new_tasks(self):
-        with write_session() as session:
-            try:
-                recordings = session.exec(
-                    select(RecordingEntity)
-                    .where(RecordingEntity.recognize_status == RecordingTaskStatus.FINISHED.value)
-                    .where(RecordingEntity.analysis_status == RecordingTaskStatus.NEW.value)
+        try:
+            with write_session() as session:
+                # Исключаем уже поставленные задачи: иначе каждый запуск возвращает те же записи,
+                # а воркеры тратят запросы на заведомо неудачный захват
+                with self.lock:
+                    pending_ids = list(self.pending_ids)
+
+                # Нужен только id: полные строки не загружаются
+                recording_ids = session.exec(
+                    select(RecordingEntity.id)
+                    .where(RecordingEntity.recognize_status == RecordingTaskStatus.FINISHED)
+                    .where(RecordingEntity.analysis_status == RecordingTaskStatus.NEW)
+                    .where(col(RecordingEntity.id).not_in(pending_ids) if pending_ids else True)
                     .limit(self.max_workers * 2)  # Берем в 2 раза больше задач, чем воркеров
                 ).all()
 
-                for recording in recordings:
-                    self.add_task(recording.id)
-            except Exception as e:
-                Logger.err(f"Error fetching new tasks: {e}")
+            # Задачи ставятся после закрытия сессии: add_task ждет свободного слота,
+            # и соединение не должно все это время простаивать в открытой транзакции
+            for recording_id in recording_ids:
+                self.add_task(recording_id)
+        except Exception as e:
+            Logger.err(f"Error fetching new tasks: {e}")
 
     def start_fetcher(self, interval: int = 30):
         def fetcher():
-            while self.is_running:
+            while not self.shutdown_event.is_set():
                 try:
+                    # Запрос к БД выполняется вне блокировки: add_task может ждать свободного места,
+                    # а освобождают его воркеры, которым нужна та же блокировка
                     with self.lock:
-                        if self.task_queue.qsize() < self.max_workers:
-                            self.fetch_new_tasks()
+                        has_capacity = len(self.pending_ids) < self.max_workers
+                    if has_capacity:
+                        self.fetch_new_tasks()
                 except Exception as e:
                     Logger.err(f"Error in fetcher: {e}")
 
-                import time
-                time.sleep(interval)
+                # Записи, готовые к анализу, приходят через NOTIFY; interval — опрос на случай пропущенных
+                self.listener.wait(interval)
+            self.listener.close()
 
         fetcher_thread = Thread(target=fetcher, daemon=True, name="TaskFetcher")
         fetcher_thread.start()
 
     def shutdown(self):
-        self.is_running = False
-        for _ in range(self.max_workers):
-            self.task_queue.put(None)
-
-        for worker in self.workers:
-            worker.join()
+        self.shutdown_event.set()
+        # Будим наблюдателя, ожидающего уведомление или свободного места в пуле
+        self.listener.stop()
+        self.slots.release()
+        # Дожидаемся текущих задач; поставленные, но не начатые, завершаются сразу по shutdown_event
+        wait(list(self.futures))
+
+        # Останавливаем процессы пакетного анализа
+        self.analyzer.close()
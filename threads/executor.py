@@ -0,0 +1,82 @@
+# threads/executor.py
+import os
+from concurrent.futures import Future
+from itertools import count
+from queue import PriorityQueue
+from threading import Lock, Thread
+from typing import Callable, List
+
+# Приоритеты задач общего пула: меньше — раньше.
+# Распознавание ждет пользователь, анализ терпит задержку
+RECOGNITION_PRIORITY = 0
+ANALYSIS_PRIORITY = 1
+# Сигнал остановки потока: встает в очередь после всех задач
+_STOP_PRIORITY = float("inf")
+
+
+class PriorityExecutor:
+    """
+    Общий пул потоков для распознавания и анализа.
+    Свободный поток берет задачу с наименьшим приоритетом, при равном — самую раннюю,
+    поэтому распознавание не ждет за очередью анализа. Потоки запускаются при первой задаче:
+    процессы без роли планировщика их не создают
+    """
+
+    def __init__(self, max_workers: int, thread_name_prefix: str = "AppWorker"):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self._queue = PriorityQueue()
+        # Порядковый номер задачи: сохраняет очередность внутри приоритета и не дает сравнивать Future
+        self._counter = count()
+        self._threads: List[Thread] = []
+        self._lock = Lock()
+        self._shutdown = False
+
+    def submit(self, priority: int, fn: Callable, *args) -> Future:
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            if not self._threads:
+                self._start_threads()
+            future = Future()
+            self._queue.put((priority, next(self._counter), future, fn, args))
+            return future
+
+    def _start_threads(self):
+        for index in range(self.max_workers):
+            thread = Thread(target=self._worker, daemon=True, name=f"{self.thread_name_prefix}_{index}")
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            _, _, future, fn, args = self._queue.get()
+            if future is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False):
+        """Останавливает потоки; при cancel_futures задачи, еще не взятые в работу, отменяются"""
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                while not self._queue.empty():
+                    _, _, future, _, _ = self._queue.get_nowait()
+                    if future is not None:
+                        future.cancel()
+            for _ in self._threads:
+                self._queue.put((_STOP_PRIORITY, next(self._counter), None, None, None))
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+# Один пул на процесс: распознавание и анализ делят потоки вместо двух независимых пулов
+app_executor = PriorityExecutor(max_workers=(os.cpu_count() or 1) * 2)
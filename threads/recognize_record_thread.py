@@ -1,69 +1,100 @@
-import time
 from datetime import datetime
-from queue import Queue
 from threading import Event, Lock
 from typing import Optional
-from concurrent.futures import ThreadPoolExecutor
 
-from sqlmodel import select, asc, col
+from sqlmodel import select, asc, col, update
 
 from classes.conversation_analyzer import ConversationAnalyzer
 from classes.daemon import Daemon
 from classes.logger import Logger
+from database.conversations import save_conversation
 from database.database import write_session
+from database.notifications import ANALYSIS_CHANNEL, RECOGNIZE_CHANNEL, NotificationListener, notify
 from entities.enums.recording_task_status import RecordingTaskStatus
 from entities.recording_entity import RecordingEntity
 from models.recording_models import RecordingGet
+from threads.executor import RECOGNITION_PRIORITY, app_executor
+
+
+# Интервал опроса БД, если уведомление о новой записи не пришло (секунды)
+WATCH_INTERVAL = 30
 
 
 class RecognizeThread:
     def __init__(self, max_workers: int = 2):
-        self.task_queue = Queue()
         self.current_tasks = {}  # Словарь для отслеживания выполняемых задач {task_id: task}
+        self.queued_ids = set()  # ID задач, переданных в общий пул, но еще не начатых
         self.shutdown_event = Event()
         self.watcher_thread: Optional[Daemon] = None
-        self.worker_executor = ThreadPoolExecutor(
-            max_workers=max_workers,
-            thread_name_prefix="RecognitionWorker"
-        )
+        self.listener = NotificationListener(RECOGNIZE_CHANNEL)
         self.lock = Lock()
         self.max_workers = max_workers
+        # Анализатор создается при первой задаче, а не при импорте модуля,
+        # чтобы процессы без роли планировщика не загружали модель
+        self.analyzer: Optional[ConversationAnalyzer] = None
+        self.analyzer_lock = Lock()
+
+    def get_analyzer(self) -> ConversationAnalyzer:
+        """Общий для всех задач анализатор разговоров"""
+        with self.analyzer_lock:
+            if self.analyzer is None:
+                self.analyzer = ConversationAnalyzer()
+            return self.analyzer
 
     def _watch(self):
         """Поток для поиска новых задач и добавления их в очередь"""
         while not self.shutdown_event.is_set():
             try:
                 self._fetch_new_tasks()
-                time.sleep(3)  # Уменьшили интервал проверки
+                # Новые записи приходят через NOTIFY; опрос раз в WATCH_INTERVAL — на случай пропущенных.
+                # Ожидание прерывается сразу при остановке
+                self.listener.wait(WATCH_INTERVAL)
             except Exception as e:
                 Logger.err(f"Error in watcher thread: {str(e)} {type(e)}")
-                time.sleep(10)
+                self.shutdown_event.wait(10)
+        self.listener.close()
 
     def _fetch_new_tasks(self):
         """Поиск новых задач в базе данных"""
         with write_session() as session:
-            # Получаем ID текущих выполняемых задач
+            # Получаем ID текущих выполняемых и ожидающих задач
             with self.lock:
-                current_task_ids = list(self.current_tasks.keys())
-
-            # Ищем задачи со статусом NEW, исключая текущие
+                current_task_ids = [*self.current_tasks.keys(), *self.queued_ids]
+            # Пул общий с анализом: в нем не больше max_workers распознаваний, по числу
+            # одновременных вызовов модели. Освободившийся воркер будит наблюдателя через wake()
+            free_slots = self.max_workers - len(current_task_ids)
+            if free_slots <= 0:
+                return
+
+            # Ищем задачи со статусом NEW, исключая текущие и уже поставленные в очередь
+            # Для задачи нужны только id и путь: остальные поля не читаются
             new_tasks = session.exec(
-                select(RecordingEntity)
+                select(RecordingEntity.id, RecordingEntity.path, RecordingEntity.created)
                 .where(
-                    RecordingEntity.recognize_status == RecordingTaskStatus.NEW.value,
+                    RecordingEntity.recognize_status == RecordingTaskStatus.NEW,
                     col(RecordingEntity.id).not_in(current_task_ids) if current_task_ids else True
                 )
                 .order_by(asc(RecordingEntity.created))
-                .limit(self.max_workers * 2)  # Берем больше задач чем воркеров
+                .limit(free_slots)
             ).all()
 
-            for task in new_tasks:
-                self._add_task_to_queue(task)
+            for task_id, path, created in new_tasks:
+                # Значения пришли из БД, повторная валидация не нужна
+                self._add_task_to_queue(RecordingGet.model_construct(id=task_id, path=path, created=created))
 
-    def _add_task_to_queue(self, db_record: RecordingEntity):
-        """Добавляет задачу в очередь"""
-        task = RecordingGet.model_validate(db_record.model_dump())
-        self.task_queue.put(task)
+    def _add_task_to_queue(self, task: RecordingGet):
+        """Передает задачу в общий пул с приоритетом распознавания"""
+        with self.lock:
+            if task.id in self.queued_ids or task.id in self.current_tasks:
+                return
+            self.queued_ids.add(task.id)
+        try:
+            app_executor.submit(RECOGNITION_PRIORITY, self._process_task, task)
+        except RuntimeError:
+            # Пул уже остановлен
+            with self.lock:
+                self.queued_ids.discard(task.id)
+            return
         Logger.debug(f'Added task to queue: {task.id}, path: {task.path}')
 
     def _process_task(self, task: RecordingGet):
@@ -71,43 +102,59 @@ class RecognizeThread:
         try:
             # Добавляем задачу в список выполняемых
             with self.lock:
+                self.queued_ids.discard(task.id)
+                # Задача, дождавшаяся потока пула уже после остановки, не начинается
+                if self.shutdown_event.is_set():
+                    return
                 self.current_tasks[task.id] = task
 
             # Помечаем задачу как PENDING
+            # Захватываем задачу одним UPDATE ... RETURNING: запись переводится в PENDING, только если она все еще NEW
             with write_session() as session:
-                db_record = session.get(RecordingEntity, task.id)
-                if not db_record:
-                    Logger.err(f"Task not found in DB: {task.id}")
-                    return
-
-                if db_record.recognize_status != RecordingTaskStatus.NEW.value:
-                    Logger.debug(f"Task {task.id} already in progress, skipping")
+                claimed_id = session.scalar(
+                    update(RecordingEntity)
+                    .where(
+                        RecordingEntity.id == task.id,
+                        RecordingEntity.recognize_status == RecordingTaskStatus.NEW
+                    )
+                    .values(
+                        recognize_status=RecordingTaskStatus.PENDING,
+                        recognize_start=datetime.now()
+                    )
+                    .returning(RecordingEntity.id)
+                )
+                if claimed_id is None:
+                    Logger.debug(f"Task {task.id} not found or already in progress, skipping")
                     return
 
-                db_record.recognize_status = RecordingTaskStatus.PENDING.value
-                db_record.recognize_start = datetime.now()
-                session.add(db_record)
-                session.commit()
-
             Logger.info(f'Starting recognition for task: {task.id}')
 
-            # Выполняем распознавание
-            analyzer = ConversationAnalyzer()
-            analysis = analyzer.analyze(task.path)
+            # Выполняем распознавание: реплики приходят сразу словарями, без моделей Utterance
+            duration, utterances = self.get_analyzer().analyze_as_dicts(task.path)
 
             with write_session() as session:
-                # Обновляем запись после завершения обработки
-                db_record = session.get(RecordingEntity, task.id)
-                if db_record:
-                    db_record.duration = analysis.duration
-                    db_record.conversation = [u.model_dump() for u in analysis.utterances]
-                    db_record.recognize_end = datetime.now()
-                    db_record.recognize_status = RecordingTaskStatus.FINISHED.value
-                    db_record.analysis_status = RecordingTaskStatus.NEW.value
-                    session.add(db_record)
-                    session.commit()
-
-            analyzer.cleanup_temp_files()
+                # Реплики сохраняются строками conversations; прежние подсветки сбрасываются до нового анализа
+                stale_conversations = save_conversation(
+                    session,
+                    task.id,
+                    [dict(utterance, text_with_highlights=None, analysis=None) for utterance in utterances]
+                )
+                # Обновляем запись после завершения обработки, не загружая ее
+                session.exec(
+                    update(RecordingEntity)
+                    .add_cte(stale_conversations)
+                    .where(RecordingEntity.id == task.id)
+                    .values(
+                        duration=duration,
+                        recognize_end=datetime.now(),
+                        recognize_status=RecordingTaskStatus.FINISHED,
+                        analysis_status=RecordingTaskStatus.NEW
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                # Запись готова к анализу — будим TaskProcessor
+                notify(session, ANALYSIS_CHANNEL)
+
             Logger.info(f'Successfully processed task: {task.id}')
 
         except Exception as e:
@@ -118,49 +165,36 @@ class RecognizeThread:
             with self.lock:
                 if task.id in self.current_tasks:
                     del self.current_tasks[task.id]
-
-    def _worker_loop(self):
-        """Основной цикл обработки задач"""
-        while not self.shutdown_event.is_set():
-            try:
-                if not self.task_queue.empty():
-                    task = self.task_queue.get(timeout=2)
-                    if task:
-                        # Запускаем обработку в отдельном потоке
-                        self.worker_executor.submit(self._process_task, task)
-                else:
-                    time.sleep(1)  # Короткая пауза если очередь пуста
-            except Exception as e:
-                Logger.err(f"Error in worker loop: {str(e)}")
-                time.sleep(5)
+            # Место освободилось — наблюдатель сразу берет следующую запись
+            self.listener.wake()
 
     def _mark_task_as_failed(self, task_id: int):
         """Пометить задачу как завершенную с ошибкой"""
         with write_session() as session:
-            db_record = session.get(RecordingEntity, task_id)
-            if db_record:
-                db_record.recognize_end = datetime.now()
-                db_record.recognize_status = RecordingTaskStatus.FAILED.value
-                session.add(db_record)
-                session.commit()
+            session.exec(
+                update(RecordingEntity)
+                .where(RecordingEntity.id == task_id)
+                .values(
+                    recognize_end=datetime.now(),
+                    recognize_status=RecordingTaskStatus.FAILED
+                )
+                .execution_options(synchronize_session=False)
+            )
 
     def start(self):
         """Запуск потоков"""
         self.watcher_thread = Daemon(self._watch)
-        self.worker_thread = Daemon(self._worker_loop)
         Logger.info(f"Recognition threads started with {self.max_workers} workers")
 
     def stop(self):
         """Остановка потоков"""
         self.shutdown_event.set()
-
-        # Останавливаем executor
-        self.worker_executor.shutdown(wait=False, cancel_futures=True)
+        # Будим наблюдателя, ожидающего уведомление. Общий пул останавливается после
+        # обоих планировщиков; поставленные задачи распознавания завершатся сразу по shutdown_event
+        self.listener.stop()
 
         if self.watcher_thread:
             self.watcher_thread.thread.join(timeout=5)
-        if self.worker_thread:
-            self.worker_thread.thread.join(timeout=5)
 
         Logger.info("Recognition threads stopped")
 
@@ -176,8 +210,9 @@ class RecognizeThread:
 
     def get_queue_size(self) -> int:
         """Возвращает размер очереди задач"""
-        return self.task_queue.qsize()
+        with self.lock:
+            return len(self.queued_ids)
 
 
-# Создаем экземпляр с 4 рабочими потоками
+# Один слот распознавания в общем приоритетном пуле app_executor: модель Whisper загружена одна
 recognize_thread = RecognizeThread(max_workers=1)
\ No newline at end of file